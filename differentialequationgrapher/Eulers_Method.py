@@ -1,14 +1,50 @@
 # Standard Library
 from inspect import getsource
-from typing import Callable, List, Tuple
+from math import exp, isfinite, log
+from sys import argv
+from time import perf_counter
+from typing import Callable, Iterator, List, NamedTuple, Tuple
+
+# Local
+from compiled_function import compile_function
+
+# Dormand-Prince tableau
+DP_C = (0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1)
+DP_A = (
+    (),
+    (1 / 5,),
+    (3 / 40, 9 / 40),
+    (44 / 45, -56 / 15, 32 / 9),
+    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+    (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+)
+DP_B = (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0)
+DP_E = (
+    71 / 57600,
+    0,
+    -71 / 16695,
+    71 / 1920,
+    -17253 / 339200,
+    22 / 525,
+    -1 / 40,
+)
+
+
+class Solution(NamedTuple):
+    """Points from a solver along with how much work it took."""
+
+    points: List[Tuple[float, float]]
+    steps: int
+    evaluations: int
 
 
 # Differential equation class
 class DifferentialEquation:
     """Class which continas a differential equation f and some useful methods."""
 
-    def __init__(self, f: Callable[[float, float], float]):
-        self.f = f
+    def __init__(self, f: Callable[[float, float], float], compiled: bool = False):
+        self.f = compile_function(f).scalar if compiled else f
 
     def __str__(self) -> str:
         string = getsource(self.f)
@@ -37,6 +73,159 @@ class DifferentialEquation:
             z.append((x0, y0))
         return z
 
+    def eulers_method_iter(
+        self, x0: float, x1: float, y0: float, iter: int, every: int = 1
+    ) -> Iterator[Tuple[float, float]]:
+        """Yields every k-th point from eulers method, always including the first and last."""
+        f = self.f
+        dx: float = (x1 - x0) / iter
+
+        # Go through iterations of Eulers method
+        yield (x0, y0)
+        for i in range(1, iter + 1):
+            y0 += dx * f(x0, y0)
+            x0 += dx
+            if i % every == 0 or i == iter:
+                yield (x0, y0)
+
+    def eulers_method_endpoint(
+        self, x0: float, x1: float, y0: float, iter: int
+    ) -> Tuple[float, float]:
+        """Returns only the final point from eulers method."""
+        f = self.f
+        dx: float = (x1 - x0) / iter
+
+        # Go through iterations of Eulers method
+        for _ in range(0, iter):
+            y0 += dx * f(x0, y0)
+            x0 += dx
+        return (x0, y0)
+
+    def runge_kutta(
+        self, x0: float, x1: float, y0: float, iter: int
+    ) -> Solution:
+        """Returns the points from the classic fixed step 4th order Runge-Kutta method."""
+        f = self.f
+        dx: float = (x1 - x0) / iter
+
+        # Go through iterations of RK4
+        z = [(x0, y0)]
+        for i in range(0, iter):
+            k1 = f(x0, y0)
+            k2 = f(x0 + dx / 2, y0 + dx * k1 / 2)
+            k3 = f(x0 + dx / 2, y0 + dx * k2 / 2)
+            k4 = f(x0 + dx, y0 + dx * k3)
+            y0 += dx * (k1 + 2 * k2 + 2 * k3 + k4) / 6
+            x0 = z[0][0] + (i + 1) * dx
+            z.append((x0, y0))
+        return Solution(z, iter, 4 * iter)
+
+    def dormand_prince(
+        self,
+        x0: float,
+        x1: float,
+        y0: float,
+        rtol: float = 1e-8,
+        atol: float = 1e-10,
+        max_steps: int = 1000000,
+        min_step: float = 1e-12,
+    ) -> Solution:
+        """Returns the points from the adaptive embedded RK45 (Dormand-Prince) method.
+
+        Raises RuntimeError after max_steps attempted steps, when f stops being
+        finite or when the step shrinks below min_step.
+        """
+        f = self.f
+        direction = 1 if x1 >= x0 else -1
+        dx: float = (x1 - x0) / 100
+        k1 = f(x0, y0)
+        evaluations = 1
+        steps = 0
+        attempts = 0
+
+        # Take steps until x1 is reached, adapting dx to the error estimate
+        z = [(x0, y0)]
+        while direction * (x1 - x0) > 0:
+            if attempts >= max_steps:
+                raise RuntimeError("Step limit reached before x1")
+            if abs(dx) < min_step:
+                raise RuntimeError(f"Step size fell below {min_step} at x = {x0}")
+            attempts += 1
+            if direction * (x0 + dx - x1) > 0:
+                dx = x1 - x0
+
+            # Stages, the last one is reused as k1 of the next step
+            k = [k1]
+            for i in range(1, 7):
+                yi = y0 + dx * sum(a * kj for a, kj in zip(DP_A[i], k))
+                k.append(f(x0 + DP_C[i] * dx, yi))
+            evaluations += 6
+            y_new = y0 + dx * sum(b * ki for b, ki in zip(DP_B, k))
+            error = abs(dx * sum(e * ki for e, ki in zip(DP_E, k)))
+            scale = atol + rtol * max(abs(y0), abs(y_new))
+            ratio = error / scale
+            if not isfinite(ratio):
+                raise RuntimeError(f"f is not finite near x = {x0}")
+
+            # Accept the step if the error is within tolerance
+            if ratio <= 1:
+                x0 = x1 if dx == x1 - x0 else x0 + dx
+                y0 = y_new
+                k1 = k[6]
+                steps += 1
+                z.append((x0, y0))
+
+            # Grow or shrink the step
+            factor = 5.0 if ratio == 0 else 0.9 * ratio ** (-1 / 5)
+            dx *= min(5.0, max(0.2, factor))
+        return Solution(z, steps, evaluations)
+
+
+# Benchmark
+def benchmark():
+    """Prints final value error against function evaluations for each method."""
+    x0, y0 = 1, 4
+    x1 = 2
+
+    def func(x: float, y: float) -> float:
+        return y * (x * log(x))
+
+    # y = C * e^(x^2 ln(x) / 2 - x^2 / 4)
+    exact = y0 * exp(x1**2 * log(x1) / 2 - x1**2 / 4 + 1 / 4)
+    de = DifferentialEquation(func)
+
+    runs: List[Tuple[str, Callable[[], Solution]]] = []
+    for iter in (1000, 100000, 10000000):
+        runs.append(
+            (
+                f"euler  iter={iter}",
+                lambda iter=iter: Solution(
+                    de.eulers_method(x0, x1, y0, iter), iter, iter
+                ),
+            )
+        )
+    for iter in (10, 100, 1000):
+        runs.append(
+            (f"rk4    iter={iter}", lambda iter=iter: de.runge_kutta(x0, x1, y0, iter))
+        )
+    for rtol in (1e-4, 1e-8, 1e-12):
+        runs.append(
+            (
+                f"rk45   rtol={rtol:g}",
+                lambda rtol=rtol: de.dormand_prince(x0, x1, y0, rtol, rtol * 1e-2),
+            )
+        )
+
+    for name, run in runs:
+        t = perf_counter()
+        solution = run()
+        elapsed = perf_counter() - t
+        error = abs(solution.points[-1][1] - exact)
+        print(
+            f"{name:<20} evaluations: {solution.evaluations:>10} "
+            f"error: {error:.3e} time: {elapsed:.4f}s"
+        )
+
 
 # Main
 def main():
@@ -54,7 +243,7 @@ def main():
 
     # Solve
     de = DifferentialEquation(func)
-    z = de.eulers_method(x0, x1, y0, iter=iter_count)
+    z = [(x0, y0), de.eulers_method_endpoint(x0, x1, y0, iter=iter_count)]
 
     # Print results
     print("Function dy/dx = {}\n".format(de))
@@ -64,4 +253,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in argv:
+        benchmark()
+    else:
+        main()
@@ -0,0 +1,204 @@
+# Standard Library
+import ast
+import math
+from inspect import getclosurevars, getsource, signature
+from textwrap import dedent
+from types import CodeType, SimpleNamespace
+from typing import Any, Callable, Optional, Union
+from weakref import WeakKeyDictionary
+
+# External Libraries
+import numpy as np
+from numpy import ndarray
+
+# Constants
+Number = Union[float, ndarray]
+DOMAIN_ERRORS = (ZeroDivisionError, ValueError)
+MATH_TO_NUMPY: dict[str, Any] = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "asin": np.arcsin,
+    "acos": np.arccos,
+    "atan": np.arctan,
+    "atan2": np.arctan2,
+    "sinh": np.sinh,
+    "cosh": np.cosh,
+    "tanh": np.tanh,
+    "asinh": np.arcsinh,
+    "acosh": np.arccosh,
+    "atanh": np.arctanh,
+    "exp": np.exp,
+    "expm1": np.expm1,
+    "log": np.log,
+    "log2": np.log2,
+    "log10": np.log10,
+    "log1p": np.log1p,
+    "sqrt": np.sqrt,
+    "fabs": np.fabs,
+    "floor": np.floor,
+    "ceil": np.ceil,
+    "trunc": np.trunc,
+    "pow": np.power,
+    "hypot": np.hypot,
+    "copysign": np.copysign,
+    "degrees": np.degrees,
+    "radians": np.radians,
+}
+
+# Compiled (scalar, array) kernels keyed on the source they came from
+_cache: dict[tuple[str, tuple[str, ...]], tuple[CodeType, CodeType]] = {}
+_compiled: "WeakKeyDictionary[Callable[..., float], tuple[CodeType, CompiledFunction]]"
+_compiled = WeakKeyDictionary()
+
+
+# Source parsing
+def _returned(body: list[ast.stmt]) -> Optional[ast.expr]:
+    """The expression a body made of a lone return gives back, else None."""
+    if len(body) == 1 and isinstance(body[0], ast.Return):
+        return body[0].value
+    return None
+
+
+def _returns_inf(handler: ast.ExceptHandler) -> bool:
+    """Whether an except clause only returns inf."""
+    value = _returned(handler.body)
+    return value is not None and ast.unparse(value) in ("inf", "math.inf")
+
+
+def get_expression(f: Callable[..., float]) -> str:
+    """Pull the returned expression out of f.
+
+    Only a body that is a single return, optionally in a try whose handlers
+    return inf, is a single expression. Anything else raises RuntimeError.
+    """
+    tree = ast.parse(dedent(getsource(f)))
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.FunctionDef):
+        raise RuntimeError("Unable to parse f(x, y)")
+
+    # Leave out the docstring and math imports, _math_imports resolves those
+    body = [
+        statement
+        for statement in tree.body[0].body
+        if not isinstance(statement, (ast.Import, ast.ImportFrom))
+        and not (
+            isinstance(statement, ast.Expr)
+            and isinstance(statement.value, ast.Constant)
+        )
+    ]
+    if (
+        len(body) == 1
+        and isinstance(body[0], ast.Try)
+        and all(_returns_inf(handler) for handler in body[0].handlers)
+        and not (body[0].orelse or body[0].finalbody)
+    ):
+        body = body[0].body
+    expression = _returned(body)
+    if expression is None:
+        raise RuntimeError("Unable to parse f(x, y)")
+    return ast.unparse(expression)
+
+
+def _math_imports(f: Callable[..., float]) -> dict[str, Any]:
+    """Find names imported from math inside the body of f."""
+    names: dict[str, Any] = {}
+    for node in ast.walk(ast.parse(dedent(getsource(f)))):
+        if isinstance(node, ast.ImportFrom) and node.module == "math":
+            for alias in node.names:
+                names[alias.asname or alias.name] = getattr(math, alias.name)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == "math":
+                    names[alias.asname or alias.name] = math
+    return names
+
+
+def _to_numpy(value: Any) -> Any:
+    """Swap a math function or the math module for its NumPy equivalent."""
+    if value is math:
+        return SimpleNamespace(**{**vars(math), **MATH_TO_NUMPY})
+    name = getattr(value, "__name__", None)
+    if name in MATH_TO_NUMPY and getattr(math, name) is value:
+        return MATH_TO_NUMPY[name]
+
+    # Anything else is left as is, math functions without an equivalent
+    # raise TypeError when given an array
+    return value
+
+
+# Compiled functions
+class CompiledFunction:
+    """The return expression of f compiled once to run on scalars or whole arrays."""
+
+    def __init__(self, f: Callable[..., float]):
+        self.__wrapped__ = f
+        self.expression = get_expression(f)
+        params = tuple(signature(f).parameters)
+
+        # Compile the expression once per source
+        key = (self.expression, params)
+        if key not in _cache:
+            _cache[key] = _compile(self.expression, params)
+        scalar_code, array_code = _cache[key]
+
+        # Resolve every name the expression uses
+        closure = getclosurevars(f)
+        names: dict[str, Any] = {}
+        names.update(closure.builtins)
+        names.update(closure.globals)
+        names.update(closure.nonlocals)
+        names.update(_math_imports(f))
+
+        # Scalar kernel uses math, array kernel uses NumPy
+        scalar_namespace = {"inf": math.inf, "DOMAIN_ERRORS": DOMAIN_ERRORS}
+        scalar_namespace.update(names)
+        exec(scalar_code, scalar_namespace)
+        self.scalar: Callable[..., float] = scalar_namespace["scalar"]
+        self.scalar.__wrapped__ = f  # type: ignore
+        array_namespace = {name: _to_numpy(value) for name, value in names.items()}
+        exec(array_code, array_namespace)
+        self._array: Callable[..., ndarray] = array_namespace["array"]
+
+    def __call__(self, *args: Number) -> Number:
+        if any(isinstance(arg, ndarray) for arg in args):
+            return self.array(*args)
+        return self.scalar(*args)
+
+    def array(self, *args: ndarray) -> ndarray:
+        """Evaluate over whole arrays, domain errors become inf."""
+        with np.errstate(all="ignore"):
+            values = np.asarray(self._array(*args), dtype=float)
+            values = np.where(np.isfinite(values), values, math.inf)
+        return np.broadcast_to(values, np.broadcast(*args).shape).copy()
+
+
+def compile_function(f: Callable[..., float]) -> CompiledFunction:
+    """Compile f into a kernel that runs on scalars or whole arrays."""
+    if isinstance(f, CompiledFunction):
+        return f
+
+    # Build once per function, again only if its code is swapped out
+    code = getattr(f, "__code__", None)
+    cached = _compiled.get(f)
+    if cached is not None and cached[0] is code:
+        return cached[1]
+    compiled = CompiledFunction(f)
+    _compiled[f] = (code, compiled)  # type: ignore
+    return compiled
+
+
+def _compile(expression: str, params: tuple[str, ...]) -> tuple[CodeType, CodeType]:
+    """Compile the modules defining the scalar and array kernels for an expression."""
+    arguments = ", ".join(params)
+    scalar_source = (
+        f"def scalar({arguments}):\n"
+        f"    try:\n"
+        f"        return {expression}\n"
+        f"    except DOMAIN_ERRORS:\n"
+        f"        return inf\n"
+    )
+    array_source = f"def array({arguments}):\n    return {expression}\n"
+    return (
+        compile(scalar_source, "<compiled f>", "exec"),
+        compile(array_source, "<compiled f>", "exec"),
+    )
@@ -1,13 +1,25 @@
 # Standard Library
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
 from inspect import getsource
 from math import atan, ceil, cos, e, floor, inf, pi, sin
+from multiprocessing.shared_memory import SharedMemory
+from os import cpu_count, makedirs, path, remove, replace, scandir, utime
+from sys import argv
+from time import perf_counter
 from typing import Callable, Tuple
 
 # External Libraries
+import numpy as np
 from matplotlib import pyplot as plot
-from numpy import linspace, sign
+from numpy import linspace, ndarray, sign
+from PIL.Image import Image, fromarray
 from PIL.Image import new as newimg
 
+# Local
+from compiled_function import compile_function
+
 # Constants
 Color = tuple[int, int, int]
 C_MAJOR = (0.8, 0.8, 0.8)
@@ -15,6 +27,8 @@ C_POS = (0.5, 1, 0)
 C_NEG = (1, 0.1, 0.1)
 C_INF = (255, 51, 255)
 C_EULER = (0.25, 0.25, 1)
+FIELD_CACHE = path.join(path.dirname(path.abspath(__file__)), "cache")
+FIELD_CACHE_BYTES = 512 * 1024**2
 
 # Differential Equation
 def f(x: float, y: float) -> float:
@@ -68,6 +82,27 @@ def value_to_rgb(v: float) -> Color:
     else:
         return C_INF
 
+def compress_array(v: ndarray) -> ndarray:
+    """Map every element from (-inf, inf) -> (-1, 1), keeping inf as a domain error."""
+    with np.errstate(invalid="ignore"):
+        out = (2 * np.arctan(v)) / pi
+    out[v == inf] = inf
+    return out
+
+def value_to_rgb_array(v: ndarray) -> ndarray:
+    """Map every element from (-1, 1) to [0, 255], returns a uint8 RGB array."""
+    with np.errstate(invalid="ignore"):
+        valid = (-1 <= v) & (v <= 1)
+        new_v = np.floor(np.abs(255 * np.where(valid, v, 0)))
+
+    # Pick the negative or positive color and scale it
+    colors = np.where((v < 0)[..., None], np.array(C_NEG), np.array(C_POS))
+    rgb = np.floor(colors * new_v[..., None])
+
+    # Anything outside (-1, 1) is a domain error
+    rgb[~valid] = C_INF
+    return rgb.astype(np.uint8)
+
 def convert_to_rgb(color: Tuple[float, float, float]) -> Color:
     """Convert from ([0, 1), [0, 1), [0, 1)) to ([0, 255], [0, 255], [0, 255])."""
     red = ceil(color[0] * 255)
@@ -83,54 +118,283 @@ def eulers_method(pos: tuple[float, float], dx: float) -> tuple[float, float]:
     pos = (pos[0] + dx, pos[1] + dx * f(pos[0], pos[1]))
     return pos
 
-def create_euler_line(pos: tuple[float, float], dx: float, h_bounds: tuple[float, float],
-                      v_bounds: tuple[float, float], iterlimit: int) -> dict[str, list[float]]:
-    """Creates an euler line."""
-    # create euler line throuhg the graph
-    px = [pos[0]]
-    py = [pos[1]]
-    npos = pos
+def _euler_half(pos: tuple[float, float], dx: float, h_bounds: tuple[float, float],
+                v_bounds: tuple[float, float], iterlimit: int) -> tuple[array, array]:
+    """Steps from pos in one direction, returns every point including the one that left the bounds."""
+    px = array("d", [pos[0]])
+    py = array("d", [pos[1]])
+    x, y = pos
 
     # iterate the point through the slope field
     for step in range(0, iterlimit):
         # if within domain and range
-        if ((h_bounds[0] <= npos[0] <= h_bounds[1])
-            and (v_bounds[0] <= npos[1] <= v_bounds[1])):
-            npos = eulers_method(npos, dx)
+        if (h_bounds[0] <= x <= h_bounds[1]) and (v_bounds[0] <= y <= v_bounds[1]):
+            x, y = x + dx, y + dx * f(x, y)
 
             # add position to domain and range
-            px.append(npos[0])
-            py.append(npos[1])
+            px.append(x)
+            py.append(y)
         else:
             print("iter: (" + str(step) + " / " + str(iterlimit) + ")")
             break
-    px = px[:-1]
-    py = py[:-1]
-    px.reverse()
-    py.reverse()
+    return px, py
 
-    npos = pos
-    for step in range(0, iterlimit):
-        # if within domain and range
-        if ((h_bounds[0] <= npos[0] <= h_bounds[1])
-            and (v_bounds[0] <= npos[1] <= v_bounds[1])):
-            npos = eulers_method(npos, -dx)
+def create_euler_line(pos: tuple[float, float], dx: float, h_bounds: tuple[float, float],
+                      v_bounds: tuple[float, float], iterlimit: int) -> dict[str, ndarray]:
+    """Creates an euler line."""
+    # create euler line through the graph in both directions
+    fx, fy = _euler_half(pos, dx, h_bounds, v_bounds, iterlimit)
+    bx, by = _euler_half(pos, -dx, h_bounds, v_bounds, iterlimit)
+    if len(fx) == 1:
+        # starting point is out of bounds
+        return {"x": np.empty(0), "y": np.empty(0)}
+
+    # drop the last point of each half, join the reversed backward half to the forward half
+    fx_view, fy_view = np.frombuffer(fx), np.frombuffer(fy)
+    bx_view, by_view = np.frombuffer(bx), np.frombuffer(by)
+    output = {"x": np.concatenate((bx_view[-2:0:-1], fx_view[:-1])),
+              "y": np.concatenate((by_view[-2:0:-1], fy_view[:-1]))}
 
-            # add position to domain and range
-            px.append(npos[0])
-            py.append(npos[1])
-        else:
-            print("iter: (" + str(step) + " / " + str(iterlimit) + ")")
+    return output
+
+def create_euler_lines(starts: ndarray, dx: float, h_bounds: tuple[float, float],
+                       v_bounds: tuple[float, float], iterlimit: int,
+                       chunk: int = 1024) -> list[dict[str, ndarray]]:
+    """Creates an euler line for every (x, y) row of starts, stepping them all together."""
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    n = len(starts)
+
+    # Lanes [0, n) step forward and lanes [n, 2n) step backward
+    x = np.concatenate((starts[:, 0], starts[:, 0]))
+    y = np.concatenate((starts[:, 1], starts[:, 1]))
+    step_dx = np.concatenate((np.full(n, dx), np.full(n, -dx)))
+    steps = np.zeros(2 * n, dtype=np.int64)
+
+    def in_bounds(x: ndarray, y: ndarray) -> ndarray:
+        return ((h_bounds[0] <= x) & (x <= h_bounds[1])
+                & (v_bounds[0] <= y) & (y <= v_bounds[1]))
+
+    # Each chunk holds the next steps of only the lanes active when it began,
+    # so stopped lanes take no more room
+    chunks: list[tuple[ndarray, ndarray, ndarray]] = []
+    active = in_bounds(x, y)
+    evaluate = array_evaluator(f)
+
+    # iterate the points through the slope field
+    step = 0
+    for step in range(1, iterlimit + 1):
+        lanes = np.flatnonzero(active)
+        if len(lanes) == 0:
             break
-    px = px[:-1]
-    py = py[:-1]
-    px.reverse()
-    py.reverse()
-    output = {"x": px, "y": py}
+
+        # step only the lanes still within domain and range
+        lx, ly = x[lanes], y[lanes]
+        x[lanes] = lx + step_dx[lanes]
+        y[lanes] = ly + step_dx[lanes] * evaluate(lx, ly)
+        steps[lanes] += 1
+        active[lanes] = in_bounds(x[lanes], y[lanes])
+
+        # record positions of the chunk's lanes
+        row = (step - 1) % chunk
+        if row == 0:
+            shape = (chunk, len(lanes))
+            chunks.append((lanes, np.empty(shape), np.empty(shape)))
+        chunk_lanes, chunk_x, chunk_y = chunks[-1]
+        chunk_x[row] = x[chunk_lanes]
+        chunk_y[row] = y[chunk_lanes]
+    print("iter: (" + str(step) + " / " + str(iterlimit) + ") for " + str(n) + " lines")
+
+    def lane_points(lane: int, count: int) -> tuple[ndarray, ndarray]:
+        """The first count points of a lane, its start then its steps."""
+        px, py = [starts[lane % n, :1]], [starts[lane % n, 1:]]
+        remaining = count - 1
+        for chunk_lanes, chunk_x, chunk_y in chunks:
+            if remaining <= 0:
+                break
+            column = np.searchsorted(chunk_lanes, lane)
+            rows = min(remaining, chunk)
+            px.append(chunk_x[:rows, column])
+            py.append(chunk_y[:rows, column])
+            remaining -= rows
+        return np.concatenate(px), np.concatenate(py)
+
+    # drop the last point of each half, join the reversed backward half to the forward half
+    output: list[dict[str, ndarray]] = []
+    for i in range(n):
+        forward, backward = steps[i], steps[n + i]
+        if forward == 0:
+            # starting point is out of bounds
+            output.append({"x": np.empty(0), "y": np.empty(0)})
+            continue
+        fx, fy = lane_points(i, forward)
+        bx, by = lane_points(n + i, backward)
+        output.append({"x": np.concatenate((bx[:0:-1], fx)),
+                       "y": np.concatenate((by[:0:-1], fy))})
 
     return output
 
 
+# Slope field rendering
+def array_evaluator(f: Callable[[float, float], float]
+                    ) -> Callable[[ndarray, ndarray], ndarray]:
+    """Returns a function evaluating f elementwise over arrays.
+
+    It tries f on the arrays, then f compiled to NumPy, then f one point at a
+    time, and sticks with the first one that works.
+    """
+    def direct(xs: ndarray, ys: ndarray) -> ndarray:
+        # a scalar only f can catch its own error and return a single value,
+        # so only a full array counts
+        with np.errstate(all="ignore"):
+            values = f(xs, ys)  # type: ignore
+        if not (isinstance(values, ndarray) and values.shape == xs.shape):
+            raise TypeError("f did not return an array")
+        return values.astype(float)
+
+    methods: list[Callable[[ndarray, ndarray], ndarray]] = [direct]
+    try:
+        # f only takes scalars, compile its expression to run on arrays
+        methods.append(compile_function(f).array)
+    except (TypeError, RuntimeError, OSError, SyntaxError):
+        pass
+    # f can't be compiled, evaluate it one point at a time
+    methods.append(np.vectorize(f, otypes=[float]))
+
+    def evaluate(xs: ndarray, ys: ndarray) -> ndarray:
+        while len(methods) > 1:
+            try:
+                return methods[0](xs, ys)
+            except (TypeError, ValueError, NameError):
+                methods.pop(0)
+        return methods[0](xs, ys)
+    return evaluate
+
+def evaluate_array(f: Callable[[float, float], float], xs: ndarray, ys: ndarray) -> ndarray:
+    """Evaluate f elementwise over the arrays xs and ys."""
+    return array_evaluator(f)(xs, ys)
+
+def evaluate_field(f: Callable[[float, float], float], hpoints: ndarray,
+                   vpoints: ndarray) -> ndarray:
+    """Evaluate f over the grid of hpoints and vpoints, indexed as [y, x]."""
+    xs, ys = np.meshgrid(hpoints, vpoints)
+    return evaluate_array(f, xs, ys)
+
+def render_slope_field_pixels(f: Callable[[float, float], float], hpoints: ndarray,
+                              vpoints: ndarray) -> Image:
+    """Render the slope field one pixel at a time."""
+    size = (len(hpoints), len(vpoints))
+    de_image = newimg("RGB", size, (255, 255, 255))
+
+    # Iterate over image
+    for y in range(0, size[1]):
+        for x in range(0, size[0]):
+            v = compress(f(hpoints[x], vpoints[y]))
+            de_image.putpixel((x, -(y + 1)), value_to_rgb(v))
+    return de_image
+
+def _render_band(f: Callable[[float, float], float], hpoints: ndarray, vpoints: ndarray,
+                 band: tuple[int, int], shm_name: str):
+    """Render the rows band[0] to band[1] of vpoints straight into a shared image buffer."""
+    shm = SharedMemory(shm_name)
+    try:
+        image = np.ndarray((len(vpoints), len(hpoints), 3), np.uint8, buffer=shm.buf)
+        rgb = value_to_rgb_array(compress_array(
+            evaluate_field(f, hpoints, vpoints[band[0]:band[1]])))
+
+        # The image's first row is the top of the graph
+        image[len(vpoints) - band[1]:len(vpoints) - band[0]] = rgb[::-1]
+        del image
+    finally:
+        shm.close()
+
+def render_slope_field_tiled(f: Callable[[float, float], float], hpoints: ndarray,
+                             vpoints: ndarray, workers: int | None = None,
+                             bands: int | None = None) -> Image:
+    """Render the slope field in row bands spread over a process pool."""
+    workers = workers or cpu_count() or 1
+    bands = min(bands or 4 * workers, len(vpoints))
+    edges = linspace(0, len(vpoints), bands + 1).astype(int)
+
+    # Workers write their pixels into shared memory rather than returning them
+    shm = SharedMemory(create=True, size=len(vpoints) * len(hpoints) * 3)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_render_band, f, hpoints, vpoints,
+                                   (int(edges[i]), int(edges[i + 1])), shm.name)
+                       for i in range(bands) if edges[i] < edges[i + 1]]
+            for future in futures:
+                future.result()
+        image = np.ndarray((len(vpoints), len(hpoints), 3), np.uint8, buffer=shm.buf)
+        de_image = fromarray(image.copy())
+        del image
+    finally:
+        shm.close()
+        shm.unlink()
+    return de_image
+
+def render_slope_field(f: Callable[[float, float], float], hpoints: ndarray,
+                       vpoints: ndarray, vectorized: bool = True, workers: int = 1) -> Image:
+    """Render the slope field of f, vectorized unless told otherwise."""
+    if not vectorized:
+        return render_slope_field_pixels(f, hpoints, vpoints)
+    if workers > 1:
+        return render_slope_field_tiled(f, hpoints, vpoints, workers)
+
+    # Evaluate and color the whole grid
+    return colorize_field(evaluate_field(f, hpoints, vpoints))
+
+def colorize_field(values: ndarray) -> Image:
+    """Color a grid of f values, the image's first row is the top of the graph."""
+    rgb = value_to_rgb_array(compress_array(values))
+    return fromarray(np.ascontiguousarray(rgb[::-1]))
+
+
+# Field cache
+def field_key(f: Callable[[float, float], float], hbounds: tuple[float, float],
+              vbounds: tuple[float, float], size: tuple[int, int]) -> str:
+    """Hash the source of f, the bounds and the resolution."""
+    key = repr((getsource(f), tuple(map(float, hbounds)), tuple(map(float, vbounds)),
+                tuple(map(int, size))))
+    return sha256(key.encode()).hexdigest()
+
+def cached_field(f: Callable[[float, float], float], hbounds: tuple[float, float],
+                 vbounds: tuple[float, float], size: tuple[int, int],
+                 cache_dir: str = FIELD_CACHE, max_bytes: int = FIELD_CACHE_BYTES) -> ndarray:
+    """Returns the field of f from the cache as a memory map, evaluating it on a miss."""
+    file = path.join(cache_dir, field_key(f, hbounds, vbounds, size) + ".npy")
+    if path.exists(file):
+        # Mark as recently used
+        utime(file)
+        return np.load(file, mmap_mode="r")
+
+    # Evaluate the field and store it
+    hpoints = linspace(hbounds[0], hbounds[1], size[0])
+    vpoints = linspace(vbounds[0], vbounds[1], size[1])
+    values = evaluate_field(f, hpoints, vpoints)
+    makedirs(cache_dir, exist_ok=True)
+    temp = file + ".tmp"
+    with open(temp, "wb") as out:
+        np.save(out, values)
+    replace(temp, file)
+    evict_fields(cache_dir, max_bytes)
+    return values
+
+def evict_fields(cache_dir: str = FIELD_CACHE, max_bytes: int = FIELD_CACHE_BYTES):
+    """Remove the least recently used fields until the cache fits in max_bytes."""
+    entries = sorted((entry for entry in scandir(cache_dir) if entry.name.endswith(".npy")),
+                     key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        try:
+            size = entry.stat().st_size
+            remove(entry.path)
+            total -= size
+        except OSError:
+            pass
+
+
 # Helper functions
 def make_domain(domain: tuple[float, float], interval: float) -> list[float]:
     """Create a domain using a start and end point and an interval."""
@@ -149,8 +413,28 @@ def spow(x: float, n: float) -> float:
     return x
 
 
+# Benchmarks
+def benchmark_render(accuracies: tuple[int, ...] = (1, 2, 3), workers: int = 0):
+    """Prints pixels per second for the per-pixel, vectorized and tiled renderers."""
+    workers = workers or cpu_count() or 1
+    for accuracy in accuracies:
+        size = (ceil((8 * pi) * e**accuracy), ceil((8 * pi) * e**accuracy))
+        hpoints = linspace(-8 * pi, 8 * pi, size[0])
+        vpoints = linspace(-8 * pi, 8 * pi, size[1])
+        pixels = size[0] * size[1]
+
+        for mode, vectorized, mode_workers in (("per-pixel", False, 1),
+                                               ("vectorized", True, 1),
+                                               (f"tiled x{workers}", True, workers)):
+            t = perf_counter()
+            render_slope_field(f, hpoints, vpoints, vectorized, mode_workers)
+            elapsed = perf_counter() - t
+            print(f"accuracy {accuracy} {size[0]}x{size[1]} {mode:>10}: "
+                  f"{pixels / elapsed:,.0f} pixels/s ({elapsed:.3f}s)")
+
+
 # Main
-def main():
+def main(vectorized: bool = True, workers: int = 1, cache: bool = True, lines: int = 100):
     # Setup
     accuracy = 2
     size = (ceil((8 * pi) * e**accuracy), ceil((8 * pi) * e**accuracy))
@@ -169,15 +453,16 @@ def main():
     dx = 0.00001
     iterlimit = 40000000
 
-    # Image
-    de_image = newimg("RGB", size, (255, 255, 255))
+    # Ensemble of euler lines, one per starting point up the y axis
+    starts = [(0.0, y) for y in linspace(vbounds[0], vbounds[1], lines)]
+    ensemble_dx = 0.001
+    ensemble_iterlimit = 400000
 
-    # Iterate over image
-    for y in range(0, size[1]):
-        #print("y: " + str(y))
-        for x in range(0, size[0]):
-            v = compress(f(hpoints[x], vpoints[y]))
-            de_image.putpixel((x, -(y + 1)), value_to_rgb(v))
+    # Image
+    if cache and vectorized and workers == 1:
+        de_image = colorize_field(cached_field(f, hbounds, vbounds, size))
+    else:
+        de_image = render_slope_field(f, hpoints, vpoints, vectorized, workers) # type: ignore
     print("Image Created")
 
     # Setup plot
@@ -216,10 +501,28 @@ def main():
     print("Euler line created")
     ax.plot(euler_line['x'], euler_line['y'], color = C_EULER,
             label = "Trends starting at: " + str(pos))
+    if starts:
+        for line in create_euler_lines(np.array(starts), ensemble_dx, hbounds, vbounds,
+                                       ensemble_iterlimit):
+            ax.plot(line['x'], line['y'], color = C_EULER, linewidth = 0.5)
+        print("Euler lines created")
 
     # Finish plotting
     plot.legend()
     plot.show()
 
 if __name__ == '__main__':
-    main()
+    # Worker count for tiled rendering, e.g. --workers=4, and how many euler
+    # lines to overlay, e.g. --lines=300
+    workers = 1
+    lines = 100
+    for arg in argv:
+        if arg.startswith("--workers="):
+            workers = int(arg.removeprefix("--workers="))
+        if arg.startswith("--lines="):
+            lines = int(arg.removeprefix("--lines="))
+
+    if "--bench" in argv:
+        benchmark_render(workers=workers if workers > 1 else 0)
+    else:
+        main("--per-pixel" not in argv, workers, "--no-cache" not in argv, lines)
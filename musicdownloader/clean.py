@@ -1,18 +1,18 @@
-from os import getcwd, path, remove, listdir
+from os import getcwd, path, listdir
+from cleanup import Cleaner
 
 # Get main path
 main_path = getcwd()
 if main_path[-6:] != 'loader':
-    main_path = path.join(main_path, 'music downloader')
+    main_path = path.join(main_path, 'musicdownloader')
     if not path.exists(main_path):
         raise FileNotFoundError('unable to locate main directory')
 music_path = path.join(main_path, 'music')
 src_path = path.join(music_path, 'src')
 
-# Deletes all dowloaded videos
+# Deletes all dowloaded videos, along with anything rip.py couldn't remove
+cleaner = Cleaner(path.join(music_path, 'cleanup.txt'))
 for file in listdir(src_path):
     if file.endswith('.mp4'):
-        try:
-            remove(path.join(src_path, file))
-        except PermissionError:
-            pass
+        cleaner.delete(path.join(src_path, file))
+cleaner.close()
@@ -0,0 +1,102 @@
+from typing import List, Optional, Tuple
+from heapq import heappop, heappush
+from os import path, remove
+from queue import Empty, Queue
+from threading import Thread
+from time import time
+
+
+# Deletes files in the background as soon as they are handed over
+class Cleaner:
+    """Removes files on a worker thread, retrying files in use with backoff.
+
+    Files that still can't be removed when the cleaner is closed are written
+    to pending_file, and the next Cleaner made with it tries them first.
+    """
+
+    def __init__(self, pending_file: str, attempts: int = 8, delay: float = 0.1):
+        self.pending_file = pending_file
+        self.attempts = attempts
+        self.delay = delay
+        self.failed: List[str] = []
+        self.stop_by = float("inf")
+        self.queue: "Queue[Optional[str]]" = Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+        # Drain what the last run left behind
+        if path.exists(pending_file):
+            with open(pending_file, "r") as pending:
+                leftovers = [line.strip() for line in pending if line.strip()]
+            remove(pending_file)
+            self.delete(*leftovers)
+
+    def delete(self, *files: str):
+        """Queues files for removal."""
+        for file in files:
+            self.queue.put(file)
+
+    def close(self, wait: float = 10) -> List[str]:
+        """Waits up to wait seconds for retries, saves and reports leftovers."""
+        self.queue.put(None)
+        self.thread.join(wait)
+
+        # Wake the worker to give up on files still being retried
+        self.stop_by = 0.0
+        self.queue.put(None)
+        self.thread.join()
+
+        # Keep whatever is left for the next run
+        if self.failed:
+            with open(self.pending_file, "a") as pending:
+                for file in self.failed:
+                    pending.write(file + "\n")
+            print("Could not remove, will retry next run:")
+            for file in self.failed:
+                print("    " + file)
+        return self.failed
+
+    def _run(self):
+        # Files waiting to be retried, as (retry time, attempt, file)
+        retries: List[Tuple[float, int, str]] = []
+        closing = False
+
+        while not closing or retries:
+            # Sleep until a file arrives or the next retry is due
+            timeout = None
+            if retries:
+                timeout = max(0.0, retries[0][0] - time())
+            try:
+                file = self.queue.get(timeout=timeout)
+                if file is None:
+                    closing = True
+                else:
+                    self._try(file, 0, retries)
+            except Empty:
+                pass
+
+            # Retry files that are due
+            while retries and retries[0][0] <= time():
+                _, attempt, file = heappop(retries)
+                self._try(file, attempt, retries)
+
+            # Give up on the rest once close stops waiting
+            if closing and time() > self.stop_by:
+                self.failed.extend(file for _, _, file in retries)
+                retries.clear()
+
+            # Nothing left to wait for once closing
+            if closing and not retries and self.queue.empty():
+                break
+
+    def _try(self, file: str, attempt: int, retries: List[Tuple[float, int, str]]):
+        """Removes a file, scheduling a retry if it is still in use."""
+        try:
+            remove(file)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            if attempt + 1 >= self.attempts:
+                self.failed.append(file)
+            else:
+                heappush(retries, (time() + self.delay * 2**attempt, attempt + 1, file))
@@ -0,0 +1,173 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from http.client import HTTPException
+from math import ceil
+from os import path
+from threading import Lock
+from time import sleep, time
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+# Bytes held in memory at once per download
+CHUNK_SIZE = 1024 * 1024
+
+# Called with (file, bytes so far, total bytes, bytes per second)
+ProgressHook = Callable[[str, int, int, float], None]
+
+
+# Collects numbers for the end of run summary
+class RunStats:
+    """Per-file download throughput, retries and time spent muxing."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.downloads: List[Tuple[str, int, float]] = []
+        self.mux_times: List[float] = []
+        self.retries = 0
+
+    def add_download(self, file: str, size: int, seconds: float):
+        with self.lock:
+            self.downloads.append((file, size, seconds))
+
+    def add_mux(self, seconds: float):
+        with self.lock:
+            self.mux_times.append(seconds)
+
+    def add_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def summary(self) -> str:
+        """Total bytes, average and p95 per-file throughput and the time split."""
+        with self.lock:
+            total = sum(size for _, size, _ in self.downloads)
+            rates = sorted(
+                size / max(seconds, 1e-9) for _, size, seconds in self.downloads
+            )
+            download_time = sum(seconds for _, _, seconds in self.downloads)
+            mux_time = sum(self.mux_times)
+            retries = self.retries
+        average = sum(rates) / len(rates) if rates else 0.0
+        p95 = rates[ceil(0.95 * len(rates)) - 1] if rates else 0.0
+        return (
+            "{} files, {:.2f} MB downloaded, {} retries\n"
+            "throughput per file: average {:.2f} MB/s, p95 {:.2f} MB/s\n"
+            "time: download {:.2f}s, mux {:.2f}s"
+        ).format(
+            len(rates),
+            total / 1e6,
+            retries,
+            average / 1e6,
+            p95 / 1e6,
+            download_time,
+            mux_time,
+        )
+
+
+# Prints progress at most once a second per file
+_last_print: Dict[str, float] = {}
+
+
+def print_progress(file: str, done: int, size: int, rate: float):
+    """Default progress hook."""
+    now = time()
+    if done < size and now - _last_print.get(file, 0) < 1:
+        return
+    _last_print[file] = now
+    print(
+        "<{}> {:.1f}/{:.1f} MB {:.2f} MB/s".format(
+            path.basename(file), done / 1e6, size / 1e6, rate / 1e6
+        )
+    )
+
+
+# Downloads one range of bytes, retrying with backoff
+def _fetch_range(
+    url: str,
+    start: int,
+    end: int,
+    retries: int,
+    backoff: float,
+    stats: Optional[RunStats],
+) -> Optional[bytes]:
+    """Returns bytes start to end, or None if the server doesn't do ranges."""
+    for attempt in range(retries + 1):
+        try:
+            request = Request(url, headers={"Range": "bytes={}-{}".format(start, end)})
+            with urlopen(request, timeout=30) as response:
+                if getattr(response, "status", None) != 206:
+                    return None
+                data = response.read()
+            if len(data) != end - start + 1:
+                raise OSError("short read of {} bytes".format(len(data)))
+            return data
+        except (URLError, HTTPException, OSError) as error:
+            if attempt == retries:
+                raise
+            print("retrying <{}> after: {}".format(url, error))
+            if stats is not None:
+                stats.add_retry()
+            sleep(backoff * 2**attempt)
+    return None
+
+
+# Downloads a whole response when ranges aren't supported
+def _fetch_whole(
+    url: str,
+    file: str,
+    size: int,
+    chunk_size: int,
+    progress: Optional[ProgressHook],
+    t: float,
+):
+    """Streams the full body to file a chunk at a time."""
+    done = 0
+    with urlopen(url, timeout=30) as response, open(file, "wb") as out:
+        for chunk in iter(lambda: response.read(chunk_size), b""):
+            out.write(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(file, done, size, done / max(time() - t, 1e-9))
+
+
+# Downloads a url into file in fixed-size chunks
+def fetch(
+    url: str,
+    file: str,
+    size: int,
+    chunk_size: int = CHUNK_SIZE,
+    retries: int = 5,
+    backoff: float = 0.5,
+    progress: Optional[ProgressHook] = print_progress,
+    stats: Optional[RunStats] = None,
+) -> int:
+    """Downloads the rest of url into file, carrying on from a partial file.
+
+    Returns the number of bytes transferred.
+    """
+    position = path.getsize(file) if path.exists(file) else 0
+    if position > size:
+        position = 0
+    start = position
+    t = time()
+
+    with open(file, "r+b" if path.exists(file) else "wb") as out:
+        out.seek(position)
+        out.truncate()
+        while position < size:
+            end = min(position + chunk_size, size) - 1
+            data = _fetch_range(url, position, end, retries, backoff, stats)
+            if data is None:
+                break
+            out.write(data)
+            position += len(data)
+            if progress is not None:
+                progress(file, position, size, (position - start) / max(time() - t, 1e-9))
+
+    # The server ignored the range, download everything again
+    if position < size:
+        _fetch_whole(url, file, size, chunk_size, progress, t)
+        start, position = 0, path.getsize(file)
+
+    if stats is not None:
+        stats.add_download(file, position - start, time() - t)
+    return position - start
@@ -0,0 +1,161 @@
+from typing import Callable, Dict, Optional, Tuple, Union
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from pathlib import Path
+from shutil import copyfile
+from threading import Thread
+import re
+
+
+# Stand-ins for pytube's YouTube and Stream that serve files from disk.
+# A url's video id names a folder in the root holding title.txt,
+# video.mp4 and audio.mp4 (or audio.webm).
+class LocalStream:
+    """Serves one file from disk like a pytube Stream."""
+
+    def __init__(
+        self,
+        file: str,
+        itag: int,
+        on_complete: Optional[Callable[["LocalStream", Optional[str]], None]] = None,
+        url: Optional[str] = None,
+    ):
+        self.file = file
+        self.url = url or Path(file).resolve().as_uri()
+        self.itag = itag
+        self.subtype = path.splitext(file)[1].removeprefix(".")
+        self.filesize = path.getsize(file)
+        self.on_complete = on_complete
+
+    def download(
+        self, output_path: Optional[str] = None, filename: Optional[str] = None
+    ) -> str:
+        """Copies the file into output_path as filename."""
+        file_path = path.join(output_path or "", filename or path.basename(self.file))
+        copyfile(self.file, file_path)
+        if self.on_complete is not None:
+            self.on_complete(self, file_path)
+        return file_path
+
+
+class LocalStreamQuery:
+    """Picks streams like pytube's StreamQuery."""
+
+    def __init__(self, streams: Dict[str, LocalStream]):
+        self.streams = streams
+
+    def get_highest_resolution(self) -> Optional[LocalStream]:
+        return self.streams.get("video")
+
+    def get_audio_only(self, subtype: str = "mp4") -> Optional[LocalStream]:
+        stream = self.streams.get("audio")
+        return stream if stream is not None and stream.subtype == subtype else None
+
+
+class LocalYouTube:
+    """Reads a video's title and streams from a folder instead of YouTube."""
+
+    root = "."
+    base_url: Optional[str] = None
+
+    def __init__(
+        self,
+        url: str,
+        on_complete_callback: Optional[
+            Callable[[LocalStream, Union[str, None]], None]
+        ] = None,
+    ):
+        match = re.search(r"(?:v=|/)([0-9A-Za-z_-]{11})", url)
+        self.video_id = match.group(1) if match else url.strip()
+        folder = path.join(self.root, self.video_id)
+        if not path.isdir(folder):
+            raise FileNotFoundError("no local video for " + url.strip())
+
+        # Title
+        with open(path.join(folder, "title.txt"), "r") as file:
+            self.title = file.read().strip()
+
+        # Streams, itags match the usual 720p mp4 and 128kbps m4a
+        streams: Dict[str, LocalStream] = {}
+        for name, itag, subtype in (
+            ("video", 22, "mp4"),
+            ("audio", 140, "mp4"),
+            ("audio", 251, "webm"),
+        ):
+            file_path = path.join(folder, name + "." + subtype)
+            if path.exists(file_path):
+                url = None
+                if self.base_url is not None:
+                    url = "{}/{}/{}.{}".format(
+                        self.base_url, self.video_id, name, subtype
+                    )
+                streams[name] = LocalStream(
+                    file_path, itag, on_complete_callback, url
+                )
+        self.streams = LocalStreamQuery(streams)
+
+    @classmethod
+    def serving(cls, root: str, base_url: Optional[str] = None) -> type:
+        """Returns a LocalYouTube class serving videos from root.
+
+        Stream urls point at base_url when given, otherwise at the files.
+        """
+        return type(cls.__name__, (cls,), {"root": root, "base_url": base_url})
+
+
+# A stand-in for YouTube's video servers
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files with support for Range requests, failing every n-th one."""
+
+    fail_every = 0
+    requests = 0
+
+    def send_head(self):
+        # Fail some requests so clients have to retry
+        cls = type(self)
+        cls.requests += 1
+        if cls.fail_every and cls.requests % cls.fail_every == 0:
+            self.send_error(503, "Simulated failure")
+            return None
+
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        file_path = self.translate_path(self.path)
+        if match is None or not path.isfile(file_path):
+            return super().send_head()
+
+        # Send only the requested bytes
+        size = path.getsize(file_path)
+        start = int(match.group(1))
+        end = min(int(match.group(2) or size - 1), size - 1)
+        if start >= size:
+            self.send_error(416, "Range not satisfiable")
+            return None
+        file = open(file_path, "rb")
+        file.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Type", self.guess_type(file_path))
+        self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.range_length = end - start + 1
+        return file
+
+    def copyfile(self, source, outputfile):
+        length = getattr(self, "range_length", None)
+        if length is None:
+            return super().copyfile(source, outputfile)
+        outputfile.write(source.read(length))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(root: str, fail_every: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Serves root over HTTP on a free local port, returns the server and its url."""
+    handler = type(
+        "Handler", (RangeRequestHandler,), {"fail_every": fail_every, "requests": 0}
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=root))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
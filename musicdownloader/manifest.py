@@ -0,0 +1,104 @@
+from typing import Optional, Tuple
+from threading import Lock
+import sqlite3
+
+# Stages an item goes through
+NEW = "new"
+DOWNLOADED = "downloaded"
+MUXED = "muxed"
+CLEANED = "cleaned"
+
+
+# Keeps track of what has been downloaded between runs
+class Manifest:
+    """SQLite record of each video's streams and how far it got."""
+
+    def __init__(self, file: str):
+        self.file = file
+        self.lock = Lock()
+        self.connection = sqlite3.connect(file, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "video_id TEXT PRIMARY KEY, url TEXT, title TEXT, stage TEXT)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS streams ("
+                "video_id TEXT, kind TEXT, itag INTEGER, size INTEGER, "
+                "checksum TEXT, PRIMARY KEY (video_id, kind))"
+            )
+
+    def get_stage(self, video_id: str) -> Optional[str]:
+        """Returns the stage of an item, None if it has never been seen."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT stage FROM items WHERE video_id = ?", (video_id,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get_title(self, video_id: str) -> Optional[str]:
+        """Returns the name a video's files went under, None if it has none yet."""
+        # Audio only items are recorded as <video_id>:audio-<format>
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT title FROM items "
+                "WHERE video_id = ? OR substr(video_id, 1, ?) = ? "
+                "ORDER BY video_id LIMIT 1",
+                (video_id, len(video_id) + 1, video_id + ":"),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def title_taken(self, title: str, video_id: str) -> bool:
+        """Returns whether the files of another video already go under title."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM items "
+                "WHERE title = ? AND video_id != ? AND substr(video_id, 1, ?) != ?",
+                (title, video_id, len(video_id) + 1, video_id + ":"),
+            ).fetchone()
+        return row is not None
+
+    def get_stream(
+        self, video_id: str, kind: str
+    ) -> Optional[Tuple[int, int, Optional[str]]]:
+        """Returns the (itag, size, checksum) recorded for a stream."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT itag, size, checksum FROM streams "
+                "WHERE video_id = ? AND kind = ?",
+                (video_id, kind),
+            ).fetchone()
+
+    def set_item(self, video_id: str, url: str, title: str, stage: str):
+        """Records an item, replacing what was there."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)",
+                (video_id, url, title, stage),
+            )
+
+    def set_stage(self, video_id: str, stage: str):
+        """Moves an item to a new stage."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE items SET stage = ? WHERE video_id = ?", (stage, video_id)
+            )
+
+    def set_stream(
+        self,
+        video_id: str,
+        kind: str,
+        itag: int,
+        size: int,
+        checksum: Optional[str] = None,
+    ):
+        """Records a stream, the checksum is left empty until it finishes."""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?, ?)",
+                (video_id, kind, itag, size, checksum),
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,172 @@
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from os import path, replace
+from threading import Lock
+from time import time
+import json
+import re
+
+# How long resolved metadata is trusted, stream urls expire after about 6 hours
+TTL = 4 * 60 * 60
+
+
+# What a download needs to know about a stream, stands in for a pytube Stream
+class StreamInfo(NamedTuple):
+    url: str
+    itag: int
+    subtype: str
+    filesize: int
+
+
+# Everything a url resolves to before downloading
+class VideoInfo(NamedTuple):
+    video_id: str
+    url: str
+    title: str
+    slug: str
+    streams: Dict[str, StreamInfo]
+
+
+# Finds the video id of a url without going to the network
+def get_video_id(url: str) -> str:
+    """Returns the 11 character video id in a url, or the url itself."""
+    match = re.search(r"(?:v=|/|^)([0-9A-Za-z_-]{11})(?:[&?#/]|$)", url.strip())
+    return match.group(1) if match else url.strip()
+
+
+# Keeps resolved metadata between runs
+class MetadataCache:
+    """JSON file of resolved videos, entries older than ttl seconds are ignored."""
+
+    def __init__(self, file: str, ttl: float = TTL):
+        self.file = file
+        self.ttl = ttl
+        self.lock = Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if path.exists(file):
+            try:
+                with open(file, "r") as cache:
+                    self.entries = json.load(cache)
+            except ValueError:
+                print("Ignoring unreadable metadata cache <" + file + ">")
+
+    def get(self, video_id: str) -> Optional[VideoInfo]:
+        """Returns the cached metadata of a video if it is still fresh."""
+        with self.lock:
+            entry = self.entries.get(video_id)
+        if entry is None or time() - entry["time"] > self.ttl:
+            return None
+        streams = {
+            kind: StreamInfo(*stream) for kind, stream in entry["streams"].items()
+        }
+        return VideoInfo(
+            video_id, entry["url"], entry["title"], entry["slug"], streams
+        )
+
+    def put(self, info: VideoInfo):
+        """Records freshly resolved metadata."""
+        with self.lock:
+            self.entries[info.video_id] = {
+                "time": time(),
+                "url": info.url,
+                "title": info.title,
+                "slug": info.slug,
+                "streams": {kind: list(s) for kind, s in info.streams.items()},
+            }
+
+    def forget(self, video_id: str):
+        """Drops a video, for when its stream urls stopped working."""
+        with self.lock:
+            self.entries.pop(video_id, None)
+
+    def save(self):
+        """Writes the cache to disk, leaving out expired entries."""
+        with self.lock:
+            entries = {
+                video_id: entry
+                for video_id, entry in self.entries.items()
+                if time() - entry["time"] <= self.ttl
+            }
+        with open(self.file + ".tmp", "w") as cache:
+            json.dump(entries, cache)
+        replace(self.file + ".tmp", self.file)
+
+
+# Looks up a url's title and the streams rip.py can use
+def resolve_url(
+    url: str, youtube: Callable[..., Any], slugify: Callable[[str], str]
+) -> VideoInfo:
+    """Builds a YouTube object once and keeps what the downloads need."""
+    yt = youtube(url)
+    streams = {
+        "video": yt.streams.get_highest_resolution(),
+        "audio": yt.streams.get_audio_only(),
+        "audio-webm": yt.streams.get_audio_only("webm"),
+    }
+    return VideoInfo(
+        yt.video_id,
+        url,
+        yt.title,
+        slugify(yt.title),
+        {
+            kind: StreamInfo(stream.url, stream.itag, stream.subtype, stream.filesize)
+            for kind, stream in streams.items()
+            if stream is not None
+        },
+    )
+
+
+# Resolves a list of url's at once, skipping repeats and cached ones
+def resolve(
+    urls: Iterable[str],
+    youtube: Callable[..., Any],
+    slugify: Callable[[str], str],
+    cache: Optional[MetadataCache] = None,
+    workers: int = 8,
+) -> List[VideoInfo]:
+    """Returns the metadata of each distinct video in order, leaving out failures."""
+    # One url per video id, ignoring blank lines and comments
+    wanted: Dict[str, str] = {}
+    for url in urls:
+        url = url.strip()
+        if url == "" or url[0] == "#":
+            continue
+        video_id = get_video_id(url)
+        if video_id in wanted:
+            print("Skipping repeat of " + video_id + ": " + url)
+            continue
+        wanted[video_id] = url
+
+    # Use the cache where it is fresh
+    resolved: Dict[str, VideoInfo] = {}
+    if cache is not None:
+        for video_id in wanted:
+            info = cache.get(video_id)
+            if info is not None:
+                resolved[video_id] = info
+
+    # Look the rest up concurrently
+    missing = [video_id for video_id in wanted if video_id not in resolved]
+    if missing:
+        t = time()
+        with ThreadPoolExecutor(max(1, min(workers, len(missing)))) as pool:
+            futures = {
+                video_id: pool.submit(resolve_url, wanted[video_id], youtube, slugify)
+                for video_id in missing
+            }
+            for video_id, future in futures.items():
+                try:
+                    resolved[video_id] = future.result()
+                except Exception as error:
+                    print("Could not resolve {}: {}".format(wanted[video_id], error))
+                    continue
+                if cache is not None:
+                    cache.put(resolved[video_id])
+        print(
+            "resolved {} url's in {:.2f}s, {} from cache".format(
+                len(missing), time() - t, len(wanted) - len(missing)
+            )
+        )
+    if cache is not None:
+        cache.save()
+    return [resolved[video_id] for video_id in wanted if video_id in resolved]
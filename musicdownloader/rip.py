@@ -1,9 +1,40 @@
-from typing import List, Union
-from os import getcwd, path, remove, mkdir
+from sys import argv
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+from os import getcwd, path, remove, replace, mkdir
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from hashlib import sha256
+from queue import Queue
+from shutil import which
+from subprocess import PIPE, run
+from threading import Thread
 import moviepy.editor as mpe  # type: ignore
 from time import time
 import unicodedata
 import re
+from manifest import CLEANED, DOWNLOADED, MUXED, NEW, Manifest
+from download_engine import RunStats, fetch
+from cleanup import Cleaner
+from metadata import MetadataCache, StreamInfo, VideoInfo, resolve
+
+# Audio only output formats, their extension, codecs that can be copied into
+# them and the encoder to use otherwise
+AUDIO_FORMATS = {
+    "m4a": ("m4a", ("aac", "alac"), "aac"),
+    "opus": ("opus", ("opus",), "libopus"),
+    "mp3": ("mp3", ("mp3",), "libmp3lame"),
+}
+
+# Download and mux numbers for the end of run summary
+stats = RunStats()
+
+# Codecs an mp4 container can hold without re-encoding
+MP4_VIDEO_CODECS = ("h264", "hevc", "av1", "mpeg4")
+MP4_AUDIO_CODECS = ("aac", "mp3", "alac", "opus")
 
 # Test for pytube existence
 try:
@@ -17,6 +48,14 @@ except ModuleNotFoundError:
     exit()
 
 
+# A downloaded video waiting to be muxed
+class Item(NamedTuple):
+    video_id: str
+    title: str
+    videofile: str
+    audiofile: str
+
+
 # Used for naming system files
 def slugify(value: str, allow_unicode: bool = False) -> str:
     """
@@ -44,7 +83,7 @@ def get_urls() -> List[str]:
     """Will read the rip.txt file to see all links and returns a list."""
     if path.exists(rip_file):
         rip = open(rip_file, "r")
-        urls = rip.readlines()
+        urls = [line.strip() for line in rip]
         rip.close()
         return urls
     else:
@@ -52,7 +91,7 @@ def get_urls() -> List[str]:
 
 
 # Prints when a download is complete
-def complete(stream: Stream, file_path: Union[str, None]):
+def complete(stream: Union[Stream, StreamInfo], file_path: Union[str, None]):
     """Notify's completion of a given download."""
     if file_path is not None:
         print("pytube - <" + path.basename(file_path) + "> download complete")
@@ -67,74 +106,479 @@ def combine_audio(vidname: str, audname: str, outname: str, fps: int = 60):
     final.write_videofile(outname, fps=fps, codec="libx264")
 
 
-# Takes a list of url's and downloads them from YouTube
-def main(urls: List[str], combine: bool = False):
-    """Will take each url and downlaod its coresponding audio and video."""
-    # A list used for cleaning up
-    delete: List[str] = []
-
-    # For each url
-    for url in urls:
-        # Ignor url's if they start with #
-        print("url: {}".format(url))
-        if url[0] == "#":
-            continue
+# Finds an ffmpeg executable
+def get_ffmpeg() -> str:
+    """Returns ffmpeg from the path, or the one bundled for moviepy."""
+    ffmpeg = which("ffmpeg")
+    if ffmpeg is not None:
+        return ffmpeg
+    import imageio_ffmpeg  # type: ignore
 
-        # Get the video stream
-        yt = YouTube(url, on_complete_callback=complete)
-        streams = yt.streams
-
-        # Get video data
-        title = yt.title
-        title = slugify(title)
-        src_path = path.join(music_path, "src")
-
-        # Get video
-        videotitle = title + "-video.mp4"
-        videofile = path.join(src_path, videotitle)
-        if path.exists(videofile):
-            remove(videofile)
-        stream = streams.get_highest_resolution()
-        if stream is not None:
-            stream.download(src_path, videotitle)
-        else:
-            print("Stream returned None.")
-            continue
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+# Reads the codecs of a file
+def get_codecs(file: str) -> Tuple[Optional[str], Optional[str]]:
+    """Returns the (video, audio) codec names of the first streams in a file."""
+    info = run([get_ffmpeg(), "-hide_banner", "-i", file], stderr=PIPE, text=True)
+    video = re.search(r"Stream #.*?: Video: (\w+)", info.stderr)
+    audio = re.search(r"Stream #.*?: Audio: (\w+)", info.stderr)
+    return (video.group(1) if video else None, audio.group(1) if audio else None)
+
+
+# Copies raw audio and video into one file without re-encoding
+def remux_audio(vidname: str, audname: str, outname: str) -> bool:
+    """Stream copies the video of one file and the audio of another, returns success."""
+    result = run(
+        [
+            get_ffmpeg(),
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            vidname,
+            "-i",
+            audname,
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0",
+            "-c",
+            "copy",
+            "-movflags",
+            "+faststart",
+            outname,
+        ],
+        stderr=PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        print("ffmpeg - " + result.stderr.strip())
+    return result.returncode == 0
+
+
+# Combines raw audio and video, copying the streams when their codecs allow it
+def mux_audio(vidname: str, audname: str, outname: str):
+    """Remuxes the streams into one file, re-encoding only if they can't be copied."""
+    video_codec = get_codecs(vidname)[0]
+    audio_codec = get_codecs(audname)[1]
+    if (
+        video_codec in MP4_VIDEO_CODECS
+        and audio_codec in MP4_AUDIO_CODECS
+        and remux_audio(vidname, audname, outname)
+    ):
+        print("ffmpeg - <" + path.basename(outname) + "> remux complete")
+        return
+    combine_audio(vidname, audname, outname)
+
+
+# Muxes and returns how long it took, for use in worker processes
+def timed_mux(vidname: str, audname: str, outname: str) -> float:
+    """Runs mux_audio, returns the seconds spent."""
+    t = time()
+    mux_audio(vidname, audname, outname)
+    return time() - t
+
+
+# Pulls the audio out of a file into another format
+def extract_audio(audname: str, outname: str, audio_format: str) -> bool:
+    """Copies the audio stream into outname, encoding only if the codec doesn't fit."""
+    copyable, encoder = AUDIO_FORMATS[audio_format][1:]
+    codec = "copy" if get_codecs(audname)[1] in copyable else encoder
+    result = run(
+        [get_ffmpeg(), "-y", "-loglevel", "error", "-i", audname]
+        + ["-vn", "-c:a", codec, outname],
+        stderr=PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        print("ffmpeg - " + result.stderr.strip())
+    return result.returncode == 0
 
-        # Get audio
-        audiotitle = title + "-audio.mp4"
-        audiofile = path.join(src_path, audiotitle)
+
+# Downloads only the audio of a url
+def rip_audio(
+    info: VideoInfo,
+    music_dir: str,
+    audio_format: str = "native",
+    manifest: Optional[Manifest] = None,
+    cleaner: Optional[Cleaner] = None,
+) -> Optional[str]:
+    """Downloads the audio stream and keeps or converts it, returns the output file."""
+    times: List[Tuple[str, float]] = []
+
+    # Pick the audio stream, webm holds opus so prefer it for opus output
+    stream = None
+    kinds = ("audio", "audio-webm")
+    for kind in reversed(kinds) if audio_format == "opus" else kinds:
+        stream = stream or info.streams.get(kind)
+    title = info.slug
+    if stream is None:
+        print("Stream returned None.")
+        return None
+    src_path = path.join(music_dir, "src")
+    # The video id keeps titles that slugify alike from sharing a source file
+    audiofile = path.join(
+        src_path, title + "-" + info.video_id + "-audio." + stream.subtype
+    )
+    extension = {"mp4": "m4a"}.get(stream.subtype, stream.subtype)
+    if audio_format != "native":
+        extension = AUDIO_FORMATS[audio_format][0]
+    outname = path.join(music_dir, title + "." + extension)
+
+    # Download, skipping and resuming with the manifest
+    t = time()
+    if manifest is None:
         if path.exists(audiofile):
             remove(audiofile)
-        stream = streams.get_audio_only()
-        if stream is not None:
-            stream.download(src_path, audiotitle)
+        download_stream(stream, audiofile)
+    else:
+        # Audio only items are kept apart from the videos and from other formats
+        video_id = info.video_id + ":audio-" + audio_format
+        record = manifest.get_stream(video_id, "audio")
+        changed = record is None or record[:2] != (stream.itag, stream.filesize)
+        stage = manifest.get_stage(video_id)
+        if not changed and stage in (MUXED, CLEANED) and path.exists(outname):
+            print("<" + title + "> already done")
+            return None
+        if changed or stage is None:
+            manifest.set_item(video_id, info.url, title, NEW)
+        if changed:
+            if path.exists(audiofile):
+                remove(audiofile)
+            manifest.set_stream(video_id, "audio", stream.itag, stream.filesize)
+        checksum = download_stream(stream, audiofile)
+        manifest.set_stream(video_id, "audio", stream.itag, stream.filesize, checksum)
+        manifest.set_stage(video_id, DOWNLOADED)
+    times.append(("download", time() - t))
+
+    # Keep the native file or extract the audio
+    t = time()
+    if audio_format == "native":
+        replace(audiofile, outname)
+    elif extract_audio(audiofile, outname, audio_format):
+        if cleaner is None:
+            remove(audiofile)
         else:
-            print("Stream returned None.")
-            continue
+            cleaner.delete(audiofile)
+    else:
+        return None
+    if manifest is not None:
+        manifest.set_stage(video_id, CLEANED)
+    times.append(("extract", time() - t))
+    stats.add_mux(times[-1][1])
+
+    # Log where the time went
+    print(
+        "<{}> {}, total {:.2f}s".format(
+            path.basename(outname),
+            ", ".join("{} {:.2f}s".format(name, spent) for name, spent in times),
+            sum(spent for _, spent in times),
+        )
+    )
+    return outname
+
+
+# Gives every video's output a name of its own
+def name_outputs(
+    infos: List[VideoInfo], manifest: Optional[Manifest] = None
+) -> List[VideoInfo]:
+    """Returns the infos with slugs no other video uses, adding the video id if needed.
+
+    A video keeps the name the manifest recorded for it, new ones get their
+    slug unless an earlier url in the run or another recorded video has it.
+    """
+    taken: Set[str] = set()
+    named: List[VideoInfo] = []
+    for info in infos:
+        recorded = manifest.get_title(info.video_id) if manifest is not None else None
+        slug = info.slug if recorded is None else recorded
+        if slug in taken or (
+            recorded is None
+            and manifest is not None
+            and manifest.title_taken(slug, info.video_id)
+        ):
+            slug += "-" + info.video_id
+        taken.add(slug)
+        named.append(info._replace(slug=slug))
+    return named
+
+
+# Reports a download that failed
+def download_failed(
+    info: VideoInfo, error: Exception, cache: Optional[MetadataCache] = None
+):
+    """Prints the error and forgets the url's metadata so the next run resolves it."""
+    # The stream url's may have expired
+    print("Download failed: {}: {}".format(info.url, error))
+    if cache is not None:
+        cache.forget(info.video_id)
+        cache.save()
+
+
+# Reports a mux that failed
+def mux_failed(item: Item, error: Exception):
+    """Prints the error, the item stays downloaded so the next run muxes it again."""
+    print("Mux failed: <{}>: {}".format(item.title, error))
 
-        del stream
+
+# Takes a list of url's and downloads only their audio
+def main_audio(
+    urls: List[str],
+    music_dir: str,
+    audio_format: str = "native",
+    youtube: Callable[..., Any] = YouTube,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[MetadataCache] = None,
+):
+    """Will take each url and download its audio."""
+    cleaner = Cleaner(path.join(music_dir, "cleanup.txt"))
+    for info in name_outputs(resolve(urls, youtube, slugify, cache), manifest):
+        print("url: {}".format(info.url))
+        try:
+            rip_audio(info, music_dir, audio_format, manifest, cleaner)
+        except Exception as error:
+            download_failed(info, error, cache)
+    cleaner.close()
+    print(stats.summary())
+
+
+# Times remuxing against re-encoding
+def benchmark_mux(vidname: str, audname: str):
+    """Prints the wall time of both muxing backends for a local sample clip."""
+    for name, mux in (("remux", remux_audio), ("re-encode", combine_audio)):
+        outname = path.join(path.dirname(vidname), "benchmark-" + name + ".mp4")
+        t = time()
+        mux(vidname, audname, outname)
+        elapsed = time() - t
+        print("{}: {:.2f}s".format(name, elapsed))
+        remove(outname)
+
+
+# Takes a list of url's and downloads them from YouTube
+def main(
+    urls: List[str],
+    combine: bool = False,
+    manifest: Optional[Manifest] = None,
+    youtube: Callable[..., Any] = YouTube,
+    cache: Optional[MetadataCache] = None,
+):
+    """Will take each url and downlaod its coresponding audio and video."""
+    # Deletes source files in the background, starting with last run's leftovers
+    cleaner = Cleaner(path.join(music_path, "cleanup.txt"))
+    src_path = path.join(music_path, "src")
+    muxed: List[Item] = []
+
+    # For each distinct url, ignoring ones that start with #
+    for info in name_outputs(resolve(urls, youtube, slugify, cache), manifest):
+        print("url: {}".format(info.url))
+
+        # Get the video and audio
+        try:
+            item = download_item(
+                info, src_path, manifest, path.join(music_path, info.slug + ".mp4")
+            )
+        except Exception as error:
+            download_failed(info, error, cache)
+            continue
+        if item is None:
+            continue
 
         # If the files should be combined
         if combine:
-            file = path.join(music_path, title + ".mp4")
-            combine_audio(videofile, audiofile, file)
+            file = path.join(music_path, item.title + ".mp4")
+            try:
+                stats.add_mux(timed_mux(item.videofile, item.audiofile, file))
+            except Exception as error:
+                mux_failed(item, error)
+                continue
+            if manifest is not None:
+                manifest.set_stage(item.video_id, MUXED)
 
-            delete.append(videofile)
-            delete.append(audiofile)
+            cleaner.delete(item.videofile, item.audiofile)
+            muxed.append(item)
 
-    # Delete the source files
-    t = time()
-    while len(delete) > 0:
-        delete_copy = delete.copy()
-        for file in delete_copy:
+    # Wait for the source files to go
+    cleaner.close()
+    mark_cleaned(muxed, manifest)
+    print(stats.summary())
+
+
+# Records items whose source files are gone as cleaned
+def mark_cleaned(items: List[Item], manifest: Optional[Manifest]):
+    """Moves muxed items to the cleaned stage once both source files are deleted."""
+    if manifest is None:
+        return
+    for item in items:
+        if not path.exists(item.videofile) and not path.exists(item.audiofile):
+            manifest.set_stage(item.video_id, CLEANED)
+
+
+# Downloads a stream, carrying on from a partial file with a range request
+def download_stream(stream: StreamInfo, file: str) -> str:
+    """Downloads the rest of a stream into file, returns the file's sha256."""
+    size = path.getsize(file) if path.exists(file) else 0
+    if size != stream.filesize:
+        fetch(stream.url, file, stream.filesize, stats=stats)
+        complete(stream, file)
+    else:
+        print("<" + path.basename(file) + "> already downloaded")
+
+    # Checksum the finished file
+    checksum = sha256()
+    with open(file, "rb") as data:
+        for chunk in iter(lambda: data.read(1024 * 1024), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# Downloads the video and audio streams of a url
+def download_item(
+    info: VideoInfo,
+    src_path: str,
+    manifest: Optional[Manifest] = None,
+    output: Optional[str] = None,
+) -> Optional[Item]:
+    """Downloads both streams of a resolved url, returns None if nothing to mux.
+
+    A finished item is only skipped while its output file is still there.
+    """
+    title = info.slug
+    chosen = {"video": info.streams.get("video"), "audio": info.streams.get("audio")}
+    if chosen["video"] is None or chosen["audio"] is None:
+        print("Stream returned None.")
+        return None
+    # The video id keeps titles that slugify alike from sharing a source file
+    files = {
+        kind: path.join(src_path, title + "-" + info.video_id + "-" + kind + ".mp4")
+        for kind in chosen
+    }
+
+    # Without a manifest always download everything again
+    if manifest is None:
+        for kind, stream in chosen.items():
+            if path.exists(files[kind]):
+                remove(files[kind])
+            download_stream(stream, files[kind])
+        return Item(info.video_id, title, files["video"], files["audio"])
+
+    # Skip finished items unless their streams have changed
+    video_id = info.video_id
+    stage = manifest.get_stage(video_id)
+    recorded = {kind: manifest.get_stream(video_id, kind) for kind in chosen}
+    changed = any(
+        recorded[kind] is None or recorded[kind][:2] != (stream.itag, stream.filesize)
+        for kind, stream in chosen.items()
+    )
+    if (
+        not changed
+        and stage in (MUXED, CLEANED)
+        and (output is None or path.exists(output))
+    ):
+        print("<" + title + "> already done")
+        return None
+    if changed or stage is None:
+        manifest.set_item(video_id, info.url, title, NEW)
+
+    # Get video and audio, resuming partial files of unchanged streams
+    for kind, stream in chosen.items():
+        record = recorded[kind]
+        if record is None or record[:2] != (stream.itag, stream.filesize):
+            if path.exists(files[kind]):
+                remove(files[kind])
+            manifest.set_stream(video_id, kind, stream.itag, stream.filesize)
+        elif (
+            record[2] is not None
+            and path.exists(files[kind])
+            and path.getsize(files[kind]) == record[1]
+        ):
+            continue
+        checksum = download_stream(stream, files[kind])
+        manifest.set_stream(video_id, kind, stream.itag, stream.filesize, checksum)
+    manifest.set_stage(video_id, DOWNLOADED)
+    return Item(video_id, title, files["video"], files["audio"])
+
+
+# Takes a list of url's and downloads them concurrently while muxing finished ones
+def main_pipelined(
+    urls: List[str],
+    music_dir: str,
+    combine: bool = False,
+    download_workers: int = 4,
+    mux_workers: int = 2,
+    youtube: Callable[..., Any] = YouTube,
+    manifest: Optional[Manifest] = None,
+    cache: Optional[MetadataCache] = None,
+):
+    """Downloads in a thread pool and muxes in a process pool, linked by a queue."""
+    src_path = path.join(music_dir, "src")
+    downloaded: "Queue[Optional[Item]]" = Queue(maxsize=2 * mux_workers)
+    infos = name_outputs(
+        resolve(urls, youtube, slugify, cache, download_workers), manifest
+    )
+
+    # Download stage, puts each finished item on the queue then a None to finish
+    def download_stage():
+        try:
+            with ThreadPoolExecutor(download_workers) as pool:
+                futures: Dict[Future[Optional[Item]], VideoInfo] = {}
+                for info in infos:
+                    print("url: {}".format(info.url))
+                    output = path.join(music_dir, info.slug + ".mp4")
+                    future = pool.submit(
+                        download_item, info, src_path, manifest, output
+                    )
+                    futures[future] = info
+                for future in as_completed(futures):
+                    try:
+                        item = future.result()
+                    except Exception as error:
+                        download_failed(futures[future], error, cache)
+                        continue
+                    if item is not None:
+                        downloaded.put(item)
+        finally:
+            # Always finish, the mux stage waits for it
+            downloaded.put(None)
+
+    downloader = Thread(target=download_stage)
+    downloader.start()
+
+    # Deletes an item's source files as soon as its mux succeeds
+    cleaner = Cleaner(path.join(music_dir, "cleanup.txt"))
+
+    def clean_item(item: Item) -> Callable[["Future[float]"], None]:
+        def clean(mux: "Future[float]"):
+            if not mux.cancelled() and mux.exception() is None:
+                cleaner.delete(item.videofile, item.audiofile)
+
+        return clean
+
+    # Mux stage, takes items off the queue as they finish downloading
+    muxed: List[Item] = []
+    with ProcessPoolExecutor(mux_workers) as pool:
+        muxes: List[Tuple[Item, Future[float]]] = []
+        while (item := downloaded.get()) is not None:
+            if combine:
+                file = path.join(music_dir, item.title + ".mp4")
+                mux = pool.submit(timed_mux, item.videofile, item.audiofile, file)
+                mux.add_done_callback(clean_item(item))
+                muxes.append((item, mux))
+        for item, mux in muxes:
             try:
-                remove(file)
-                delete.remove(file)
-            except PermissionError:
-                pass
-        if time() - t > 10:
-            break
+                stats.add_mux(mux.result())
+            except Exception as error:
+                mux_failed(item, error)
+                continue
+            if manifest is not None:
+                manifest.set_stage(item.video_id, MUXED)
+            muxed.append(item)
+    downloader.join()
+
+    # Wait for the source files to go
+    cleaner.close()
+    mark_cleaned(muxed, manifest)
+    print(stats.summary())
 
 
 if __name__ == "__main__":
@@ -156,5 +600,42 @@ if __name__ == "__main__":
         rip = open(rip_file, "w")
         rip.close()
 
-    # Run main
-    main(get_urls(), True)
+    # Record of finished downloads, so re-runs only fetch new or changed url's
+    manifest = Manifest(path.join(music_path, "manifest.sqlite"))
+
+    # Titles and streams of resolved url's, so re-runs skip looking them up
+    cache = MetadataCache(path.join(music_path, "metadata.json"))
+
+    # Run main, --pipelined [--download-workers=N] [--mux-workers=N]
+    # or --audio-only[=native|m4a|opus|mp3]
+    audio_only = [arg for arg in argv if arg.startswith("--audio-only")]
+    if audio_only:
+        audio_format = audio_only[0].removeprefix("--audio-only").lstrip("=")
+        main_audio(
+            get_urls(),
+            music_path,
+            audio_format or "native",
+            manifest=manifest,
+            cache=cache,
+        )
+    elif "--bench-mux" in argv:
+        # --bench-mux <video file> <audio file>
+        benchmark_mux(*argv[argv.index("--bench-mux") + 1 :][:2])
+    elif "--pipelined" in argv:
+        workers = {"--download-workers=": 4, "--mux-workers=": 2}
+        for arg in argv:
+            for flag in workers:
+                if arg.startswith(flag):
+                    workers[flag] = int(arg.removeprefix(flag))
+        main_pipelined(
+            get_urls(),
+            music_path,
+            True,
+            workers["--download-workers="],
+            workers["--mux-workers="],
+            manifest=manifest,
+            cache=cache,
+        )
+    else:
+        main(get_urls(), True, manifest, cache=cache)
+    manifest.close()
@@ -1,60 +1,352 @@
 import re
 import os
+import json
+import sqlite3
 import string
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from sys import argv
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
 
 # Add entries to specify lines to remove if the keyword is present
 keywords = ('#')
 
+# A question starts at "N. " anywhere, an answer at "a. " on a new line
+QUESTION = re.compile(r"[0-9]+\.\s")
+ANSWER = re.compile(r"[a-z]\.\s")
 
-# Grabs questions and answers from a poorly formatted document
-def main():
-    # Get file contents
-    file = open("text.txt", "r")
-    lines = file.readlines()
-    file.close()
+# Bytes of output held before writing to disk
+WRITE_BUFFER = 1024 * 1024
+
+
+# One question as it was found in a document
+class Question(NamedTuple):
+    stem: str
+    answers: List[str]
+
+
+# Grabs questions and answers from a poorly formatted document in one pass
+def parse(lines: Iterable[str]) -> Iterator[Question]:
+    """Yields each question in lines as soon as the next one starts.
+
+    Text before the first question is dropped and question stems are
+    joined onto one line. Only the question being read is held in memory.
+    """
+    # Pieces of the current stem, then of each of its answers
+    parts: List[List[str]] = []
+    free_newline = False
+
+    def finish() -> Question:
+        return Question(
+            "".join(parts[0]).replace("\n", " "), ["".join(part) for part in parts[1:]]
+        )
 
-    # Remove keywords markers
-    new_lines: list[str] = []
     for line in lines:
+        # Remove keywords markers
         if any(keyword in line for keyword in keywords):
             print(f"IGNORE: {line}")
-        else:
-            new_lines.append(line)
+            continue
+        position = 0
 
-    # Split by question
-    full_document = "".join(new_lines)
-    questions = re.split(r"[0-9]+\.\s", full_document)
-    questions_and_answers: list[list[str]] = []
+        # An answer takes the last line's newline, unless a marker used it up
+        marker = ANSWER.match(line) if free_newline and parts else None
+        if marker is not None:
+            parts.append([])
+            position = marker.end()
+        elif free_newline and parts:
+            parts[-1].append("\n")
 
-    # Split by answer
-    for question in questions:
-        questions_and_answers.append(re.split(r"\n[a-z]\.\s", question))
-    del questions_and_answers[0]
+        # Questions can start anywhere in the line
+        for match in QUESTION.finditer(line, position):
+            if parts:
+                parts[-1].append(line[position : match.start()])
+                yield finish()
+            parts = [[]]
+            position = match.end()
 
-    for i in range(len(questions_and_answers)):
-        questions_and_answers[i][0] = questions_and_answers[i][0].replace("\n", " ")
+        # Hold back the newline until the next line shows if it starts an answer
+        free_newline = line.endswith("\n") and position < len(line)
+        if parts:
+            parts[-1].append(line[position : len(line) - free_newline])
 
-    # Get start number for questions
-    start = int(input("start number? "))
+    if parts:
+        if free_newline:
+            parts[-1].append("\n")
+        yield finish()
+
+
+# Writes questions back out as text
+def rip(lines: Iterable[str], output: TextIO, start: int) -> int:
+    """Writes the questions in lines to output numbered from start.
 
-    # Mix questions and answers into format
-    output = ""
-    i = 0
+    Answers are relettered. Returns the question count.
+    """
     letters = string.ascii_lowercase
-    for question in questions_and_answers:
-        output += f"{start + i}. {question[0]}\n"
-        for ans in range(1, len(question)):
-            output += f"{letters[ans-1]}. {question[ans]}\n"
-        i += 1
+    count = 0
+    for count, question in enumerate(parse(lines), 1):
+        output.write(f"{start + count - 1}. {question.stem}\n")
+        for ans, answer in enumerate(question.answers):
+            output.write(f"{letters[ans]}. {answer}\n")
+    return count
+
+
+# Writes questions as one JSON object per line
+def rip_jsonl(lines: Iterable[str], output: TextIO, start: int, source: str) -> int:
+    """Writes the questions in lines to output as JSON lines, returns the count.
+
+    Stems and answers lose the whitespace around them.
+    """
+    count = 0
+    for count, question in enumerate(parse(lines), 1):
+        record = {
+            "source": source,
+            "number": start + count - 1,
+            "stem": question.stem.strip(),
+            "answers": [answer.strip() for answer in question.answers],
+        }
+        output.write(json.dumps(record) + "\n")
+    return count
+
+
+# Opens a SQLite store of questions, making its tables the first time
+def open_store(file: str) -> sqlite3.Connection:
+    """Returns a connection to a store with a full text index on the questions."""
+    connection = sqlite3.connect(file, timeout=600)
+    with connection:
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                source TEXT,
+                number INTEGER,
+                stem TEXT,
+                answers TEXT
+            );
+            CREATE INDEX IF NOT EXISTS questions_number ON questions (number);
+            CREATE INDEX IF NOT EXISTS questions_source ON questions (source);
+            CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(
+                stem, answers, content='questions', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS questions_insert AFTER INSERT ON questions
+            BEGIN
+                INSERT INTO questions_fts (rowid, stem, answers)
+                VALUES (new.id, new.stem, new.answers);
+            END;
+            CREATE TRIGGER IF NOT EXISTS questions_delete AFTER DELETE ON questions
+            BEGIN
+                INSERT INTO questions_fts (questions_fts, rowid, stem, answers)
+                VALUES ('delete', old.id, old.stem, old.answers);
+            END;
+            """
+        )
+    return connection
+
+
+# Writes questions into a SQLite store, replacing what came from the same source
+def rip_sqlite(
+    lines: Iterable[str], connection: sqlite3.Connection, start: int, source: str
+) -> int:
+    """Stores the questions in lines under source, returns the count.
+
+    Only rows from source are touched, so the rest of the store is kept.
+    """
+    rows = (
+        (
+            source,
+            start + count,
+            question.stem.strip(),
+            json.dumps([answer.strip() for answer in question.answers]),
+        )
+        for count, question in enumerate(parse(lines))
+    )
+    with connection:
+        connection.execute("DELETE FROM questions WHERE source = ?", (source,))
+        return connection.executemany(
+            "INSERT INTO questions (source, number, stem, answers) VALUES (?, ?, ?, ?)",
+            rows,
+        ).rowcount
+
+
+# Finds questions by number
+def lookup(connection: sqlite3.Connection, number: int) -> List[Tuple[str, Question]]:
+    """Returns the (source, question) pairs stored under a question number."""
+    return [
+        (source, Question(stem, json.loads(answers)))
+        for source, stem, answers in connection.execute(
+            "SELECT source, stem, answers FROM questions WHERE number = ?", (number,)
+        )
+    ]
+
 
-    # Write to file
-    file = open("new_text.txt", "w")
-    file.write(output)
-    file.close()
+# Finds questions by keyword
+def search(
+    connection: sqlite3.Connection, query: str, limit: int = 20
+) -> List[Tuple[str, int, Question]]:
+    """Returns the best (source, number, question) matches of a full text query."""
+    return [
+        (source, number, Question(stem, json.loads(answers)))
+        for source, number, stem, answers in connection.execute(
+            "SELECT source, number, questions.stem, questions.answers "
+            "FROM questions_fts "
+            "JOIN questions ON questions.id = questions_fts.rowid "
+            "WHERE questions_fts MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit),
+        )
+    ]
+
+
+# Output formats and the extension of their files
+FORMATS = {"text": ".txt", "jsonl": ".jsonl", "sqlite": ".sqlite"}
+
+
+# Rips one file into another
+def rip_file(
+    source: str, destination: str, start: int, output_format: str = "text"
+) -> int:
+    """Streams source into destination, returns the question count.
+
+    A sqlite destination is a store shared between sources, the others
+    are written over.
+    """
+    name = os.path.basename(source)
+    with open(source, "r") as lines:
+        if output_format == "sqlite":
+            connection = open_store(destination)
+            try:
+                return rip_sqlite(lines, connection, start, name)
+            finally:
+                connection.close()
+        with open(destination, "w", buffering=WRITE_BUFFER) as output:
+            if output_format == "jsonl":
+                return rip_jsonl(lines, output, start, name)
+            return rip(lines, output, start)
+
+
+# Counts questions without writing anything, for numbering ahead of time
+def count_questions(source: str) -> int:
+    """Returns how many questions rip would find in source."""
+    count = 0
+    with open(source, "r") as lines:
+        for line in lines:
+            if not any(keyword in line for keyword in keywords):
+                count += len(QUESTION.findall(line))
+    return count
+
+
+# Finds the files a batch should rip
+def find_sources(pattern: str) -> List[str]:
+    """Returns the .txt files in a directory, or the files matching a glob."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.txt")
+    return sorted(file for file in glob(pattern) if os.path.isfile(file))
+
+
+# Rips many files at once, numbering on from one file to the next
+def rip_batch(
+    sources: List[str],
+    out_dir: str,
+    start: int = 1,
+    offsets: Optional[Dict[str, int]] = None,
+    workers: Optional[int] = None,
+    output_format: str = "text",
+) -> Dict[str, int]:
+    """Rips each source into out_dir under the same name, in a process pool.
+
+    Numbering starts at start and carries on across files in order, a
+    file named in offsets (by path or name) starts at its own number and
+    the files after it carry on from there. A sqlite output goes into one
+    questions.sqlite store in out_dir. Returns each file's start.
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"unknown output format {output_format}")
+    offsets = offsets or {}
+    os.makedirs(out_dir, exist_ok=True)
+    if output_format == "sqlite":
+        destinations = [os.path.join(out_dir, "questions.sqlite")] * len(sources)
+        open_store(destinations[0]).close()
+    else:
+        destinations = [
+            os.path.join(
+                out_dir,
+                os.path.splitext(os.path.basename(source))[0]
+                + FORMATS[output_format],
+            )
+            for source in sources
+        ]
+    for source, destination in zip(sources, destinations):
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            raise ValueError(f"{source} would be overwritten, pick another --out")
+    t = perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        # Count first so every file knows its start number
+        counts = list(pool.map(count_questions, sources))
+        starts: Dict[str, int] = {}
+        number = start
+        for source, count in zip(sources, counts):
+            number = offsets.get(source, offsets.get(os.path.basename(source), number))
+            starts[source] = number
+            number += count
+
+        # Then rip them all
+        ripped = sum(
+            pool.map(
+                rip_file,
+                sources,
+                destinations,
+                [starts[source] for source in sources],
+                [output_format] * len(sources),
+            )
+        )
+
+    # Report throughput
+    elapsed = max(perf_counter() - t, 1e-9)
+    print(
+        f"{len(sources)} files, {ripped} questions in {elapsed:.2f}s "
+        f"({len(sources) / elapsed:.1f} files/s, {ripped / elapsed:.0f} questions/s)"
+    )
+    return starts
+
+
+def main():
+    # Get start number for questions
+    start = int(input("start number? "))
+    rip_file("text.txt", "new_text.txt", start)
 
 
 if __name__ == "__main__":
-    if os.path.exists("text.txt"):
+    # --batch <directory or glob> [--out=DIR] [--start=N] [--offset=FILE:N]...
+    # [--workers=N] [--format=text|jsonl|sqlite] rips many files without
+    # asking anything
+    if "--batch" in argv:
+        options = {
+            "--out=": "ripped",
+            "--start=": "1",
+            "--workers=": "0",
+            "--format=": "text",
+        }
+        offsets: Dict[str, int] = {}
+        for arg in argv:
+            for flag in options:
+                if arg.startswith(flag):
+                    options[flag] = arg.removeprefix(flag)
+            if arg.startswith("--offset="):
+                name, number = arg.removeprefix("--offset=").rsplit(":", 1)
+                offsets[name] = int(number)
+        sources = find_sources(argv[argv.index("--batch") + 1])
+        if not sources:
+            print("No files to rip!")
+        else:
+            rip_batch(
+                sources,
+                options["--out="],
+                int(options["--start="]),
+                offsets,
+                int(options["--workers="]) or None,
+                options["--format="],
+            )
+
+    elif os.path.exists("text.txt"):
         main()
 
     else:
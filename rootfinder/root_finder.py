@@ -1,3 +1,17 @@
+# Standard Library
+import csv
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count
+from sys import argv
+from time import perf_counter
+from typing import Iterator, Optional, Union
+
+# External Libraries
+import numpy as np
+from numpy import ndarray
+
+
 class Polynomial:
     def __init__(self, terms: list[float]):
         self.terms: list[float] = terms
@@ -24,23 +38,220 @@ class Polynomial:
 
         # Set the derrivative
         self._terms_prime = terms[1:]
-        print(self.terms)
-        print(self._terms_prime)
 
-    def f(self, x: float, derrivative: bool = False) -> float:
+    def f(
+        self, x: Union[float, ndarray], derrivative: bool = False
+    ) -> Union[float, ndarray]:
         # Decide polynomial
         terms = self.terms
         if derrivative:
             terms = self._terms_prime
 
         # Accumulator
-        sum: float = 0
+        sum: Union[float, ndarray] = 0
 
-        # Add each term and multiply the coefficient
-        for i in range(len(terms)):
-            sum += terms[i] * pow(x, i)
+        # Horner's method from the highest degree down, works on arrays too
+        for i in range(len(terms) - 1, -1, -1):
+            sum = sum * x + terms[i]
         return sum
 
+    def f_and_prime(
+        self, x: Union[float, ndarray]
+    ) -> tuple[Union[float, ndarray], Union[float, ndarray]]:
+        # Accumulators for the value and the derivative
+        value: Union[float, ndarray] = 0
+        slope: Union[float, ndarray] = 0
+
+        # Horner's method for both in a single pass
+        for i in range(len(self.terms) - 1, -1, -1):
+            slope = slope * x + value
+            value = value * x + self.terms[i]
+        return value, slope
+
+    def f_compensated(self, x: ndarray) -> ndarray:
+        # Compensated Horner's method, carries the rounding error of every
+        # step along so the value is about as accurate as in twice the precision
+        x = np.asarray(x, dtype=float)
+        value = np.zeros_like(x)
+        error = np.zeros_like(x)
+        with np.errstate(all="ignore"):
+            for i in range(len(self.terms) - 1, -1, -1):
+                product, product_error = _two_product(value, x)
+                value, sum_error = _two_sum(product, self.terms[i])
+                error = error * x + (product_error + sum_error)
+        return value + error
+
+    def roots(self, method: str = "aberth", polish: bool = True) -> ndarray:
+        # Find every root, complex ones included
+        if method == "aberth":
+            roots = self.aberth_roots()
+        elif method == "companion":
+            roots = self.companion_roots()
+        else:
+            raise ValueError(f"Unknown root method: {method}")
+        if polish:
+            roots = self.polish_roots(roots)
+        return roots
+
+    def aberth_roots(
+        self, tolerance: float = 1e-12, max_iterations: int = 500
+    ) -> ndarray:
+        terms = np.trim_zeros(np.array(self.terms, dtype=float), "b")
+        degree = len(terms) - 1
+        if degree < 1:
+            return np.empty(0, dtype=complex)
+
+        # Start on circles sized from the Newton polygon of the terms
+        z = _initial_roots(terms)
+        active = np.ones(degree, dtype=bool)
+
+        with np.errstate(all="ignore"):
+            for _ in range(max_iterations):
+                lanes = np.flatnonzero(active)
+                if len(lanes) == 0:
+                    break
+
+                # Sum of 1 / (z_i - z_j) over every other root
+                rows = np.arange(len(lanes))
+                diff = z[lanes, None] - z[None, :]
+                diff[rows, lanes] = 1
+                recip = 1 / diff
+                recip[rows, lanes] = 0
+
+                # Aberth step, retire lanes that can't step or have converged
+                ratio = _newton_ratio(terms, z[lanes])
+                step = ratio / (1 - ratio * recip.sum(axis=1))
+                usable = np.isfinite(step)
+                active[lanes[~usable]] = False
+                lanes, step = lanes[usable], step[usable]
+                z[lanes] -= step
+                done = np.abs(step) <= tolerance * np.maximum(1, np.abs(z[lanes]))
+                active[lanes[done]] = False
+        return z
+
+    def companion_roots(self) -> ndarray:
+        terms = np.trim_zeros(np.array(self.terms, dtype=float), "b")
+        degree = len(terms) - 1
+        if degree < 1:
+            return np.empty(0, dtype=complex)
+
+        # Eigenvalues of the companion matrix are the roots
+        matrix = np.zeros((degree, degree))
+        matrix[1:, :-1] = np.eye(degree - 1)
+        matrix[:, -1] = -terms[:-1] / terms[-1]
+        return np.linalg.eigvals(matrix).astype(complex)
+
+    def polish_roots(self, roots: ndarray, steps: int = 2) -> ndarray:
+        roots = np.array(roots, dtype=complex)
+        with np.errstate(all="ignore"):
+            for _ in range(steps):
+                # Newton step with the derivative terms
+                y = self.f(roots)
+                step = y / self.f(roots, True)
+                polished = roots - step
+
+                # Keep the step only where it lowers the value
+                better = np.isfinite(polished) & (np.abs(self.f(polished)) < np.abs(y))
+                roots[better] = polished[better]
+        return roots
+
+
+def _two_sum(a: ndarray, b: Union[float, ndarray]) -> tuple[ndarray, ndarray]:
+    # a + b and the rounding error of that sum
+    total = a + b
+    part = total - a
+    return total, (a - (total - part)) + (b - part)
+
+
+def _two_product(a: ndarray, b: ndarray) -> tuple[ndarray, ndarray]:
+    # a * b and the rounding error of that product, splitting both into
+    # halves that multiply exactly
+    def split(v: ndarray) -> tuple[ndarray, ndarray]:
+        scaled = 134217729.0 * v
+        high = scaled - (scaled - v)
+        return high, v - high
+
+    product = a * b
+    a_high, a_low = split(a)
+    b_high, b_low = split(b)
+    error = a_low * b_low - (
+        ((product - a_high * b_high) - a_low * b_high) - a_high * b_low
+    )
+    return product, error
+
+
+def _horner(terms: ndarray, x: ndarray) -> tuple[ndarray, ndarray]:
+    # Value and slope of the polynomial with terms from highest degree down
+    value = np.zeros_like(x)
+    slope = np.zeros_like(x)
+    for term in terms:
+        slope = slope * x + value
+        value = value * x + term
+    return value, slope
+
+
+def _initial_roots(terms: ndarray) -> ndarray:
+    # Upper convex hull of (i, log|a_i|), each edge gives a circle of roots
+    degree = len(terms) - 1
+    nonzero = np.flatnonzero(terms)
+    logs = np.log(np.abs(terms[nonzero]))
+    hull: list[int] = []
+    for i in range(len(nonzero)):
+        while len(hull) >= 2:
+            a, b = hull[-2], hull[-1]
+            cross = (nonzero[b] - nonzero[a]) * (logs[i] - logs[a]) - (
+                logs[b] - logs[a]
+            ) * (nonzero[i] - nonzero[a])
+            if cross < 0:
+                break
+            hull.pop()
+        hull.append(i)
+
+    # Roots at zero for missing low terms, then spread the rest on each circle
+    z = [np.zeros(nonzero[0], dtype=complex)]
+    for a, b in zip(hull, hull[1:]):
+        count = nonzero[b] - nonzero[a]
+        radius = np.exp((logs[a] - logs[b]) / count)
+        angles = 2 * np.pi * np.arange(count) / count + 2 * np.pi * nonzero[a] / degree + 0.4
+        z.append(radius * np.exp(1j * angles))
+    return np.concatenate(z)
+
+
+def _newton_ratio(terms: ndarray, z: ndarray) -> ndarray:
+    # p(z) / p'(z), using the reversed polynomial outside the unit circle
+    # so high degrees don't overflow
+    degree = len(terms) - 1
+    ratio = np.empty(len(z), dtype=complex)
+    inside = np.abs(z) <= 1
+
+    value, slope = _horner(terms[::-1], z[inside])
+    ratio[inside] = value / slope
+
+    # p(z) = z^n q(1/z) where q has the terms reversed
+    outside = z[~inside]
+    w = 1 / outside
+    value, slope = _horner(terms, w)
+    ratio[~inside] = outside * value / (degree * value - w * slope)
+    return ratio
+
+
+def root_residual(polynomial: Polynomial, roots: ndarray) -> float:
+    # Largest |p(z)| relative to the size of the terms at z, outside the
+    # unit circle both are divided by |z|^n so they don't overflow
+    terms = np.array(polynomial.terms, dtype=float)
+    roots = np.asarray(roots, dtype=complex)
+    inside = np.abs(roots) <= 1
+    points = np.where(inside, roots, 1 / roots)
+    value = np.where(
+        inside, _horner(terms[::-1], points)[0], _horner(terms, points)[0]
+    )
+    scale = np.where(
+        inside,
+        _horner(np.abs(terms[::-1]), np.abs(points))[0],
+        _horner(np.abs(terms), np.abs(points))[0],
+    )
+    return float(np.max(np.abs(value) / scale, initial=0))
+
 
 def main():
     # Get polynomial
@@ -56,6 +267,10 @@ def main():
     # Print intercept
     print(f"f({intercept:.8}) = {polynomial.f(round(intercept, 8)):.8}")
 
+    # Print every real root
+    roots = find_real_roots(polynomial)
+    print("Real roots: " + ", ".join(f"{root:.8}" for root in roots))
+
 
 def get_polynomial() -> Polynomial:
     # Instructions
@@ -75,6 +290,8 @@ def get_polynomial() -> Polynomial:
             # Form final polynomial
             terms.reverse()
             polynomial = Polynomial(terms)
+            print(polynomial.terms)
+            print(polynomial._terms_prime)
             break
 
         # Convert input
@@ -102,8 +319,7 @@ def get_x_value() -> float:
 def newtons_method(polynomial: Polynomial, x: float) -> float:
     for _ in range(10000):
         # Get value and slope
-        y = polynomial.f(x)
-        y_prime = polynomial.f(x, True)
+        y, y_prime = polynomial.f_and_prime(x)
 
         # Get next x value
         x -= y / y_prime
@@ -112,5 +328,319 @@ def newtons_method(polynomial: Polynomial, x: float) -> float:
     return x
 
 
+def newtons_method_multi(
+    polynomial: Polynomial,
+    xs: ndarray,
+    tolerance: float = 1e-12,
+    max_iterations: int = 200,
+) -> ndarray:
+    # Every starting point is a lane stepping together
+    x = np.array(xs, dtype=float)
+    active = np.isfinite(x)
+    converged = np.zeros(len(x), dtype=bool)
+
+    for _ in range(max_iterations):
+        lanes = np.flatnonzero(active)
+        if len(lanes) == 0:
+            break
+
+        # Get value and slope, lanes sitting exactly on a root are done
+        y, y_prime = polynomial.f_and_prime(x[lanes])
+        exact = y == 0
+        converged[lanes[exact]] = True
+
+        # Retire those and lanes with a zero or NaN slope
+        usable = ~exact & (y_prime != 0) & np.isfinite(y_prime) & np.isfinite(y)
+        active[lanes[~usable]] = False
+        lanes = lanes[usable]
+
+        # Get next x values, retire lanes whose step is below tolerance
+        step = y[usable] / y_prime[usable]
+        x[lanes] -= step
+        done = np.abs(step) <= tolerance * np.maximum(1, np.abs(x[lanes]))
+        converged[lanes[done]] = True
+        active[lanes[done]] = False
+
+    # Lanes still stepping have stalled, accept those whose value is rounding noise
+    lanes = np.flatnonzero(active)
+    value = polynomial.f_compensated(x[lanes])
+    converged[lanes[np.abs(value) <= rounding_noise(polynomial, x[lanes])]] = True
+
+    roots = x[converged]
+    return unique_roots(
+        roots, values=polynomial.f_compensated(roots), polynomial=polynomial
+    )
+
+
+def rounding_noise(polynomial: Polynomial, x: ndarray) -> ndarray:
+    # Rounding error of one operation on the largest term of p(x), a value
+    # below it can't be told apart from 0
+    noise = np.zeros(len(x))
+    for term in np.abs(np.array(polynomial.terms, dtype=float))[::-1]:
+        noise = noise * np.abs(x) + term
+    return noise * np.finfo(float).eps
+
+
+def unique_roots(
+    roots: ndarray,
+    tolerance: float = 1e-6,
+    values: Optional[ndarray] = None,
+    polynomial: Optional[Polynomial] = None,
+) -> ndarray:
+    # Sort and keep one root of each cluster, the one with the smallest value
+    # if values are given, otherwise the first. With the polynomial, at most
+    # its degree roots are kept
+    order = np.argsort(roots)
+    roots = np.asarray(roots)[order]
+    if len(roots) == 0:
+        return roots
+    values = np.zeros(len(roots)) if values is None else np.abs(values)[order]
+    gaps = np.diff(roots) > tolerance * np.maximum(1, np.abs(roots[1:]))
+
+    # Newton stalls around a multiple root, spreading its lanes wider than
+    # tolerance, neighbours with only rounding noise between them are one root
+    if polynomial is not None:
+        for t in (0.25, 0.5, 0.75):
+            between = roots[:-1] + t * np.diff(roots)
+            noise = rounding_noise(polynomial, between)
+            gaps &= np.abs(polynomial.f_compensated(between)) > noise
+    cluster = np.concatenate(([0], np.cumsum(gaps)))
+    best = np.lexsort((values, cluster))
+    best = best[np.concatenate(([True], np.diff(cluster[best]) > 0))]
+
+    # A degree n polynomial has at most n roots, keep the closest ones
+    if polynomial is not None:
+        terms = np.trim_zeros(np.array(polynomial.terms, dtype=float), "b")
+        best = np.sort(best[np.argsort(values[best], kind="stable")][: len(terms) - 1])
+    return roots[best]
+
+
+def find_real_roots(polynomial: Polynomial, starts: int = 0) -> ndarray:
+    # Every root lies within the Fujiwara bound
+    terms = np.trim_zeros(np.array(polynomial.terms, dtype=float), "b")
+    if len(terms) < 2:
+        return np.empty(0)
+    degree = len(terms) - 1
+    ratios = np.abs(terms[:-1] / terms[-1])
+    ratios[0] /= 2
+    bound = 2 * np.max(ratios ** (1 / np.arange(degree, 0, -1)))
+
+    # x^n has a bound of 0, which would put every start on the root itself
+    bound = bound if bound > 0 else 1.0
+
+    # Spread starting points over the bound
+    # An odd count puts a start on 0, a common exact root
+    starts = starts or max(1024, 128 * degree) + 1
+    return newtons_method_multi(polynomial, np.linspace(-bound, bound, starts))
+
+
+def newtons_method_batch(
+    coefficients: ndarray,
+    x: ndarray,
+    tolerance: float = 1e-12,
+    max_iterations: int = 200,
+) -> tuple[ndarray, ndarray]:
+    # Each row of coefficients (highest degree first) is a lane stepping together
+    x = np.array(x, dtype=float)
+    active = np.isfinite(x)
+    converged = np.zeros(len(x), dtype=bool)
+
+    for _ in range(max_iterations):
+        lanes = np.flatnonzero(active)
+        if len(lanes) == 0:
+            break
+
+        # Get value and slope for every lane with Horner's method
+        rows, xs = coefficients[lanes], x[lanes]
+        value = np.zeros(len(lanes))
+        slope = np.zeros(len(lanes))
+        for column in range(coefficients.shape[1]):
+            slope = slope * xs + value
+            value = value * xs + rows[:, column]
+
+        # Lanes sitting exactly on a root are done, retire those and lanes
+        # with a zero or NaN slope
+        exact = value == 0
+        converged[lanes[exact]] = True
+        usable = ~exact & (slope != 0) & np.isfinite(slope) & np.isfinite(value)
+        active[lanes[~usable]] = False
+        lanes = lanes[usable]
+
+        # Get next x values, retire lanes whose step is below tolerance
+        step = value[usable] / slope[usable]
+        x[lanes] -= step
+        done = np.abs(step) <= tolerance * np.maximum(1, np.abs(x[lanes]))
+        converged[lanes[done]] = True
+        active[lanes[done]] = False
+
+    return x, converged
+
+
+def read_coefficient_blocks(file: str, block_size: int) -> Iterator[ndarray]:
+    # Stream 2-D blocks of coefficients, highest degree first, from a .npy or
+    # CSV file, shorter CSV rows are padded with leading zeros
+    if file.endswith(".npy"):
+        data = np.load(file, mmap_mode="r")
+
+        # A 1-D file holds a single polynomial
+        if data.ndim == 1:
+            data = data[None, :]
+        if data.ndim != 2:
+            raise ValueError(
+                f"{file} should hold one polynomial per row, not {data.ndim}-D"
+            )
+        for start in range(0, len(data), block_size):
+            yield np.array(data[start : start + block_size], dtype=float)
+        return
+
+    def stack(rows: list[list[str]]) -> ndarray:
+        block = np.zeros((len(rows), max(len(row) for row in rows)))
+        for i, row in enumerate(rows):
+            block[i, block.shape[1] - len(row) :] = np.array(row, dtype=float)
+        return block
+
+    with open(file, "r", newline="") as lines:
+        rows: list[list[str]] = []
+        for row in csv.reader(lines):
+            # Skip blank lines and comments
+            if not row or row[0].startswith("#"):
+                continue
+            rows.append(row)
+            if len(rows) == block_size:
+                yield stack(rows)
+                rows = []
+        if rows:
+            yield stack(rows)
+
+
+def group_by_degree(block: ndarray) -> list[tuple[ndarray, ndarray]]:
+    # Drop leading zero terms and group rows of the same degree, all zero
+    # rows are left out
+    nonzero = block != 0
+    lead = np.where(nonzero.any(axis=1), nonzero.argmax(axis=1), block.shape[1])
+    return [
+        (indices, block[indices, first:])
+        for first in np.unique(lead)
+        if first < block.shape[1]
+        for indices in (np.flatnonzero(lead == first),)
+    ]
+
+
+def _solve_block(block: ndarray, x: float) -> ndarray:
+    # Roots for one block in input order, nan where Newton didn't converge
+    roots = np.full(len(block), np.nan)
+    for indices, coefficients in group_by_degree(block):
+        found, converged = newtons_method_batch(coefficients, np.full(len(indices), x))
+        roots[indices] = np.where(converged, found, np.nan)
+    return roots
+
+
+def solve_batch(
+    input_file: str,
+    output_file: str,
+    x: float = 0.0,
+    workers: Optional[int] = None,
+    block_size: int = 65536,
+) -> int:
+    # Solve every polynomial in the input over a process pool, writing roots in order
+    workers = workers or cpu_count() or 1
+    count = 0
+    t = perf_counter()
+    with ProcessPoolExecutor(workers) as pool, open(output_file, "w") as out:
+        pending: deque[Future[ndarray]] = deque()
+
+        def write_next():
+            roots = pending.popleft().result()
+            np.savetxt(out, roots, fmt="%.17g")
+
+        # Keep a bounded number of blocks in flight, the workers group them
+        for block in read_coefficient_blocks(input_file, block_size):
+            pending.append(pool.submit(_solve_block, block, x))
+            count += len(block)
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+
+    elapsed = perf_counter() - t
+    print(
+        f"{count} polynomials in {elapsed:.3f}s "
+        f"({count / elapsed:,.0f} polynomials/s)"
+    )
+    return count
+
+
+def pow_f(terms: list[float], x: float) -> float:
+    # The original term by term evaluation, kept for comparison
+    sum: float = 0
+    for i in range(len(terms)):
+        sum += terms[i] * pow(x, i)
+    return sum
+
+
+def benchmark_roots():
+    # Compare the all roots methods
+    rng = np.random.default_rng(0)
+    for degree in (10, 100, 1000):
+        polynomial = Polynomial(list(rng.normal(size=degree + 1)))
+        for method in ("aberth", "companion"):
+            t = perf_counter()
+            roots = polynomial.roots(method, polish=False)
+            elapsed = perf_counter() - t
+            t = perf_counter()
+            polished = polynomial.polish_roots(roots)
+            polish_elapsed = perf_counter() - t
+            print(
+                f"degree {degree:>4} {method:>9}: {elapsed * 1000:9.2f}ms  "
+                f"residual {root_residual(polynomial, roots):.2e}  "
+                f"polished +{polish_elapsed * 1000:.2f}ms  "
+                f"residual {root_residual(polynomial, polished):.2e}"
+            )
+
+
+def benchmark():
+    # Compare evaluation methods over degree 5 to 200 polynomials
+    rng = np.random.default_rng(0)
+    xs = rng.uniform(-1, 1, 1000)
+    for degree in (5, 20, 50, 100, 200):
+        polynomial = Polynomial(list(rng.uniform(-1, 1, degree + 1)))
+        x_list: list[float] = xs.tolist()
+
+        t = perf_counter()
+        for x in x_list:
+            pow_f(polynomial.terms, x)
+            pow_f(polynomial._terms_prime, x)
+        pow_time = perf_counter() - t
+
+        t = perf_counter()
+        for x in x_list:
+            polynomial.f_and_prime(x)
+        horner_time = perf_counter() - t
+
+        t = perf_counter()
+        polynomial.f_and_prime(xs)
+        array_time = perf_counter() - t
+
+        print(
+            f"degree {degree:>3}: pow {pow_time * 1e6 / len(xs):8.2f}us/x  "
+            f"horner {horner_time * 1e6 / len(xs):8.2f}us/x  "
+            f"array {array_time * 1e6 / len(xs):8.4f}us/x"
+        )
+
+
 if __name__ == "__main__":
-    main()
+    if "--bench" in argv:
+        benchmark()
+        benchmark_roots()
+    elif "--batch" in argv:
+        # --batch <input .csv/.npy> <output> [--x=0] [--workers=N]
+        files = argv[argv.index("--batch") + 1 :][:2]
+        x, workers = 0.0, None
+        for arg in argv:
+            if arg.startswith("--x="):
+                x = float(arg.removeprefix("--x="))
+            elif arg.startswith("--workers="):
+                workers = int(arg.removeprefix("--workers="))
+        solve_batch(files[0], files[1], x, workers)
+    else:
+        main()
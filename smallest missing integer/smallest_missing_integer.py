@@ -1,7 +1,15 @@
 # Standard Library
+import os
 import random
-from time import time
-from typing import List
+import tracemalloc
+from sys import argv
+from time import perf_counter, time
+from itertools import islice
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+# External Libraries
+import numpy as np
 
 
 # Generator of list
@@ -28,6 +36,324 @@ def smallest_missing_int1(nums: List[int]) -> int:
     return len(nums) + 1
 
 
+# Method 2, cyclic sort, puts every value v in 1..n at index v - 1 in place
+# so it needs no extra memory but reorders nums
+def smallest_missing_int2(nums: List[int]) -> int:
+    n = len(nums)
+    i = 0
+    while i < n:
+        num = nums[i]
+        if 0 < num <= n and nums[num - 1] != num:
+            nums[i], nums[num - 1] = nums[num - 1], num
+        else:
+            i += 1
+    for i in range(n):
+        if nums[i] != i + 1:
+            return i + 1
+    return n + 1
+
+
+# Method 3, one byte per candidate, index n + 1 is never set so index() stops
+def smallest_missing_int3(nums: List[int]) -> int:
+    n = len(nums)
+    seen = bytearray(n + 2)
+    for num in nums:
+        if 0 < num <= n:
+            seen[num] = 1
+    return seen.index(0, 1)
+
+
+# Method 4, boolean mask filled by numpy, accepts lists or arrays
+def smallest_missing_int4(nums: Union[List[int], np.ndarray]) -> int:
+    values = np.asarray(nums)
+    n = len(values)
+    if n == 0:
+        return 1
+    seen = np.zeros(n + 2, dtype=bool)
+    seen[0] = True
+    seen[values[(values > 0) & (values <= n)]] = True
+    return int(np.argmin(seen))
+
+
+# Batched method 4 for a 2-D array, one answer per row. Values that can't be
+# the answer all mark column 0, which is never the answer either, so the mask
+# is filled with one flat write. Rows go in chunks of about max_cells values
+def smallest_missing_int_batch(
+    rows: np.ndarray, max_cells: int = 1 << 16
+) -> np.ndarray:
+    rows = np.asarray(rows)
+    if rows.ndim != 2:
+        raise ValueError("rows must be a 2-D array")
+    count, n = rows.shape
+    answers = np.empty(count, dtype=np.int64)
+    step = max(1, max_cells // (n + 2))
+    for first in range(0, count, step):
+        chunk = rows[first : first + step]
+        seen = np.zeros((len(chunk), n + 2), dtype=bool)
+        seen[:, 0] = True
+        slots = np.where((chunk > 0) & (chunk <= n), chunk, 0).astype(np.intp)
+        slots += np.arange(0, seen.size, n + 2)[:, None]
+        seen.ravel()[slots.ravel()] = True
+        answers[first : first + len(chunk)] = np.argmin(seen, axis=1)
+    return answers
+
+
+# Batched method 4 for lists of different lengths, list i is
+# values[offsets[i]:offsets[i + 1]]. Each list gets slots for 0..length + 1
+# laid out one list after another, then the first slot not seen is found
+# for every list at once. Lists go in chunks of about max_cells values
+def smallest_missing_int_ragged(
+    values: np.ndarray, offsets: np.ndarray, max_cells: int = 1 << 16
+) -> np.ndarray:
+    values = np.asarray(values)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    answers = np.empty(max(len(offsets) - 1, 0), dtype=np.int64)
+    first = 0
+    while first < len(answers):
+        last = np.searchsorted(offsets, offsets[first] + max_cells, "right") - 1
+        last = min(max(last, first + 1), len(answers))
+        answers[first:last] = _smallest_missing_ragged_chunk(
+            values, offsets[first : last + 1]
+        )
+        first = last
+    return answers
+
+
+def _smallest_missing_ragged_chunk(
+    values: np.ndarray, offsets: np.ndarray
+) -> np.ndarray:
+    lengths = np.diff(offsets)
+    values = values[offsets[0] : offsets[-1]]
+    starts = offsets[:-1] - offsets[0] + 2 * np.arange(len(lengths))
+
+    # Values that can't be the answer mark slot 0 of their list
+    limit = np.repeat(lengths, lengths)
+    slots = np.where((values > 0) & (values <= limit), values, 0).astype(np.intp)
+    slots += np.repeat(starts, lengths)
+    seen = np.zeros(len(values) + 2 * len(lengths), dtype=bool)
+    seen[starts] = True
+    seen[slots] = True
+
+    # Slot length + 1 is never seen, so every list has a first unseen slot
+    unseen = np.flatnonzero(~seen)
+    return unseen[np.searchsorted(unseen, starts)] - starts
+
+
+# Checks the batched methods against method 0 on random lists
+def validate_batch(count: int = 2000, max_len: int = 40):
+    for dtype in (np.int64, np.int32, np.int16, np.int8, np.uint8):
+        low = -2 if np.issubdtype(dtype, np.signedinteger) else 0
+        rows = np.random.randint(low, 30, (count, 25)).astype(dtype)
+        expected = [smallest_missing_int0(row) for row in rows.tolist()]
+        for max_cells in (1000, 1 << 16):
+            if smallest_missing_int_batch(rows, max_cells).tolist() != expected:
+                raise AssertionError(
+                    f"smallest_missing_int_batch disagrees with method 0 for {dtype}"
+                )
+
+        lengths = np.random.randint(0, max_len, count)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        values = np.random.randint(low, max_len + 2, offsets[-1]).astype(dtype)
+        expected = [
+            smallest_missing_int0(values[start:end].tolist())
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        for max_cells in (100, 1 << 16):
+            if smallest_missing_int_ragged(values, offsets, max_cells).tolist() != (
+                expected
+            ):
+                raise AssertionError(
+                    f"smallest_missing_int_ragged disagrees with method 0 for {dtype}"
+                )
+
+
+# Times the batched methods on a million short lists against a per-list loop
+def benchmark_batch(count: int = 10**6, n: int = 100):
+    validate_batch()
+    rows = np.random.randint(0, n + 2, (count, n))
+    t = perf_counter()
+    smallest_missing_int_batch(rows)
+    print(f"batched, {count} lists of {n}: {perf_counter() - t:.3f}s")
+
+    lengths = np.random.randint(1, 2 * n, count)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    values = np.random.randint(0, 2 * n + 2, offsets[-1])
+    t = perf_counter()
+    smallest_missing_int_ragged(values, offsets)
+    print(f"ragged, {count} lists of 1 to {2 * n - 1}: {perf_counter() - t:.3f}s")
+
+    sample = rows[: count // 100].tolist()
+    t = perf_counter()
+    for row in sample:
+        smallest_missing_int3(row)
+    print(f"method 3 per list, estimated: {(perf_counter() - t) * 100:.3f}s")
+
+
+# One bit per candidate 1..size, packed eight to a byte
+class Bitmap:
+    def __init__(self, size: int):
+        self.size = size
+        self.bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+
+    # Sets the bits of the values in 1..size, returns the values above it
+    def mark(self, values: np.ndarray) -> np.ndarray:
+        bits = values[(values > 0) & (values <= self.size)] - 1
+        np.bitwise_or.at(self.bits, bits >> 3, (1 << (bits & 7)).astype(np.uint8))
+        return values[values > self.size]
+
+    def grow(self, size: int):
+        bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+        bits[: len(self.bits)] = self.bits
+        self.size, self.bits = size, bits
+
+    # The smallest value in 1..n + 1 whose bit isn't set
+    def first_unset(self, n: int) -> int:
+        partial = np.flatnonzero(self.bits != 0xFF)
+        if len(partial) == 0:
+            return n + 1
+        byte = int(self.bits[partial[0]])
+        bit = (~byte & (byte + 1)).bit_length() - 1
+        return min(int(partial[0]) * 8 + bit + 1, n + 1)
+
+
+# Splits numbers into int64 arrays of up to chunk_size
+def chunked(
+    nums: Union[Iterable[int], np.ndarray], chunk_size: int
+) -> Iterator[np.ndarray]:
+    if isinstance(nums, np.ndarray):
+        for first in range(0, len(nums), chunk_size):
+            yield np.asarray(nums[first : first + chunk_size], dtype=np.int64)
+        return
+    numbers = iter(nums)
+    while len(chunk := np.fromiter(islice(numbers, chunk_size), np.int64)) > 0:
+        yield chunk
+
+
+# Streaming method, reads nums a chunk at a time into a bitmap of the
+# candidates. The bitmap is n / 8 bytes when n is known from len(nums) or
+# upper_bound, otherwise it doubles as values arrive and values bigger
+# than it are held back until it grows past them
+def smallest_missing_int_stream(
+    nums: Union[Iterable[int], np.ndarray],
+    upper_bound: Optional[int] = None,
+    chunk_size: int = 1 << 16,
+) -> int:
+    growing = False
+    if upper_bound is not None:
+        size = upper_bound
+    elif hasattr(nums, "__len__"):
+        size = len(nums)  # type: ignore
+    else:
+        size, growing = chunk_size, True
+    bitmap = Bitmap(size)
+    held: List[np.ndarray] = []
+    count = 0
+    for chunk in chunked(nums, chunk_size):
+        count += len(chunk)
+        if count > bitmap.size:
+            if not growing:
+                raise ValueError(f"more than {bitmap.size} numbers")
+            bitmap.grow(max(2 * bitmap.size, count))
+            held = [bitmap.mark(values) for values in held]
+            held = [values for values in held if len(values) > 0]
+        above = bitmap.mark(chunk)
+        if growing and len(above) > 0:
+            held.append(above)
+    return bitmap.first_unset(count)
+
+
+# Streaming method for a binary file of int32 or int64, read through a
+# memory map so only one chunk is in memory at a time
+def smallest_missing_int_file(
+    file: str,
+    dtype: str = "int64",
+    upper_bound: Optional[int] = None,
+    chunk_size: int = 1 << 16,
+) -> int:
+    # numpy can't map an empty file
+    if os.path.getsize(file) == 0:
+        return smallest_missing_int_stream([], upper_bound, chunk_size)
+    nums = np.memmap(file, dtype=np.dtype(dtype), mode="r")
+    return smallest_missing_int_stream(nums, upper_bound, chunk_size)
+
+
+# Checks the streaming method against method 0, then times it on a file of
+# n int64s and reports the peak memory next to loading the whole file
+def benchmark_stream(n: int = 10**7):
+    for _ in range(1000):
+        nums = np.random.randint(-2, 40, np.random.randint(0, 40)).tolist()
+        for source in (nums, iter(nums)):
+            if smallest_missing_int_stream(source, chunk_size=7) != (
+                smallest_missing_int0(nums)
+            ):
+                raise AssertionError("smallest_missing_int_stream disagrees")
+
+    with TemporaryDirectory() as directory:
+        file = os.path.join(directory, "empty.bin")
+        open(file, "wb").close()
+        if smallest_missing_int_file(file) != 1:
+            raise AssertionError("smallest_missing_int_file disagrees on an empty file")
+
+    with TemporaryDirectory() as directory:
+        file = os.path.join(directory, "nums.bin")
+        nums = np.random.permutation(np.arange(1, n + 1))
+        nums[np.random.randint(n)] = 0
+        nums.tofile(file)
+        del nums
+
+        def whole_file() -> int:
+            return smallest_missing_int4(np.fromfile(file, np.int64))
+
+        for name, method in (
+            ("stream", lambda: smallest_missing_int_file(file)),
+            ("method 4, whole file", whole_file),
+        ):
+            tracemalloc.start()
+            t = perf_counter()
+            answer = method()
+            elapsed = perf_counter() - t
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{name}: {answer} in {elapsed:.3f}s, peak {peak / 1e6:.1f}MB")
+
+
+# Methods and the largest list each is benchmarked on
+METHODS: Dict[str, Callable[[List[int]], int]] = {
+    "method 0 (set)": smallest_missing_int0,
+    "method 1 (list scan)": smallest_missing_int1,
+    "method 2 (cyclic sort)": smallest_missing_int2,
+    "method 3 (bytearray)": smallest_missing_int3,
+    "method 4 (numpy)": smallest_missing_int4,
+}
+MAX_SIZES = {
+    "method 0 (set)": 10**6,
+    "method 1 (list scan)": 10**4,
+}
+
+
+# Times each method on random lists from 10^2 to 10^7 long
+def benchmark_scaling(max_power: int = 7):
+    for power in range(2, max_power + 1):
+        n = 10**power
+        nums = np.random.randint(0, n + 2, n).tolist()
+        repeats = max(1, 10**5 // n)
+        answers: Dict[str, int] = {}
+        print(f"n = 10^{power}")
+        for name, method in METHODS.items():
+            if n > MAX_SIZES.get(name, n):
+                continue
+
+            # Method 2 reorders its input, so each run gets a fresh copy
+            copies = [nums.copy() for _ in range(repeats)]
+            t = perf_counter()
+            for copy in copies:
+                answers[name] = method(copy)
+            elapsed = (perf_counter() - t) / repeats
+            print(f"    {name}: {elapsed * 1000:.3f}ms")
+        if len(set(answers.values())) != 1:
+            raise AssertionError(f"methods disagree for n = {n}: {answers}")
+
+
 # Main
 def main():
     # Generate list of random lists
@@ -54,6 +380,25 @@ def main():
         time_total += time() - t
     print(f"Total time for method 1: {time_total}")
 
+    # Batched, every list in one call
+    rows = np.array(random_list_list)
+    time_total = 0.0
+    for _ in range(100):
+        t = time()
+        smallest_missing_int_batch(rows)
+        time_total += time() - t
+    print(f"Total time for batched: {time_total}")
+
 
 if __name__ == "__main__":
-    main()
+    # --bench times every method on growing lists instead, --bench-batch
+    # times the batched methods on a million lists and --bench-stream the
+    # streaming method on a file of 10^7 numbers
+    if "--bench" in argv:
+        benchmark_scaling()
+    elif "--bench-batch" in argv:
+        benchmark_batch()
+    elif "--bench-stream" in argv:
+        benchmark_stream()
+    else:
+        main()